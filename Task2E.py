@@ -1,6 +1,6 @@
 from datetime import timedelta
 from floodsystem.stationdata import build_station_list, update_water_levels
-from floodsystem.datafetcher import fetch_measure_levels
+from floodsystem.datafetcher import fetch_measure_levels_many
 from floodsystem.flood import stations_highest_rel_level
 from floodsystem.plot import plot_water_levels, generalised_plot_water_levels
 
@@ -13,10 +13,14 @@ def run():
     # Update the water level so the latest level is included
     update_water_levels(stations)
 
-    # Plot the water level graph for 5 stations with the largest relative water levels
-    for station in stations_highest_rel_level(stations, 5):
-        # Get the values of time and water level for the past 10 days
-        times, values = fetch_measure_levels(station.measure_id, timedelta(days=10))
+    # Get the 5 stations with the largest relative water levels
+    stations_list = stations_highest_rel_level(stations, 5)
+    # Get the values of time and water level for the past 10 days for all the stations at once
+    histories = fetch_measure_levels_many([station.measure_id for station in stations_list], timedelta(days=10))
+
+    # Plot the water level graph for each station
+    for station in stations_list:
+        times, values = histories[station.measure_id]
         # Plot the graph
         plot_water_levels(station, times, values)
 
@@ -33,10 +37,11 @@ def run_extension():
     values = []
     # Create a lift of 6 stations with the largest relative water levels
     stations_list = stations_highest_rel_level(stations, 6)
+    # Get the values of time and water level for the past 10 days for all the stations at once
+    histories = fetch_measure_levels_many([station.measure_id for station in stations_list], timedelta(days=10))
     # Plot the water level graph for 6 stations with the largest relative water levels
     for _station in stations_list:
-        # Get the values of time and water level for the past 10 days
-        time, value = fetch_measure_levels(_station.measure_id, timedelta(days=10))
+        time, value = histories[_station.measure_id]
         # Append the values to their corresponding lists
         times.append(time)
         values.append(value)
@@ -1,7 +1,6 @@
-
 from floodsystem.stationdata import build_station_list, update_water_levels
 from floodsystem.geo import stations_by_town
-from floodsystem.flood import get_town_flood_risk, get_flood_risk_rating
+from floodsystem.flood import score_all_towns, get_flood_risk_rating
 
 def run():
     """Requirements for Task 2G"""
@@ -12,8 +11,11 @@ def run():
 
     town_names = list(towns.keys())
 
+    # Score the first 10 towns together (fetching level data concurrently)
+    town_risks, timings = score_all_towns({town: towns[town] for town in town_names[:10]})
+
     for i in range(10):
-        print(f"{town_names[i]} {get_flood_risk_rating(get_town_flood_risk(town_names[i], towns))}")
+        print(f"{town_names[i]} {get_flood_risk_rating(town_risks[town_names[i]])}")
         
 
 if __name__ == "__main__":
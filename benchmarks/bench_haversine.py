@@ -0,0 +1,56 @@
+"""Benchmark of calculating distances to all stations with the haversine
+function, one station at a time, and with the vectorised haversine kernel"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from haversine import haversine as hav  # noqa: E402
+
+from floodsystem.geo import haversine_distances, haversine_distance_matrix, station_coords  # noqa: E402
+from floodsystem.station import MonitoringStation  # noqa: E402
+
+
+def example_stations(n):
+    """Return a list of n MonitoringStation objects at random locations in
+    England"""
+    return [MonitoringStation("s-{}".format(i), None, "Station {}".format(i),
+                              (random.uniform(50, 55), random.uniform(-5, 1)), None, None, None, None)
+            for i in range(n)]
+
+
+def run(n=5000, repeat=5):
+    """Compare the time to calculate the distances from one point to all
+    stations, and between 100 points and all stations"""
+
+    stations = example_stations(n)
+    coords = station_coords(stations)
+    p = (52.2053, 0.1218)
+    points = coords[:100]
+
+    def one_scalar():
+        return [hav(station.coord, p) for station in stations]
+
+    def one_vectorised():
+        return haversine_distances(station_coords(stations), p)
+
+    def many_scalar():
+        return [[hav(tuple(q), station.coord) for station in stations] for q in points]
+
+    def many_vectorised():
+        return haversine_distance_matrix(points, station_coords(stations))
+
+    for name, function in (("1 x {} (hav)".format(n), one_scalar),
+                           ("1 x {} (kernel)".format(n), one_vectorised),
+                           ("100 x {} (hav)".format(n), many_scalar),
+                           ("100 x {} (kernel)".format(n), many_vectorised)):
+        t = min(timeit.repeat(function, number=1, repeat=repeat))
+        print("{:20} {:8.2f} ms".format(name, t * 1000))
+
+
+if __name__ == "__main__":
+    print("*** Benchmark: haversine distances ***")
+    run()
@@ -0,0 +1,50 @@
+"""Benchmark of finding the rivers with the greatest number of stations
+for large synthetic station lists, comparing sorting every river with the
+counting and heap based rivers_by_station_number"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from floodsystem.geo import rivers_by_station_number, stations_by_river  # noqa: E402
+from floodsystem.station import MonitoringStation  # noqa: E402
+from floodsystem.stationtable import StationTable  # noqa: E402
+
+
+def example_stations(n, num_rivers):
+    """Return a list of n MonitoringStation objects on num_rivers rivers
+    (with a skewed number of stations per river)"""
+    return [MonitoringStation("s-{}".format(i), "m-{}".format(i), "Station {}".format(i), (52.0, 0.0), None,
+                              "River {}".format(int(random.paretovariate(1.2)) % num_rivers), None, None)
+            for i in range(n)]
+
+
+def rivers_by_station_number_sorted(stations, N):
+    """Find the top N rivers (with ties) by grouping the stations into
+    lists and sorting every river"""
+
+    sorted_rivers = sorted(stations_by_river(stations).items(), key=lambda k: len(k[1]), reverse=True)
+    threshold = len(sorted_rivers[min(N, len(sorted_rivers)) - 1][1])
+    return [(river, len(s)) for river, s in sorted_rivers if len(s) >= threshold]
+
+
+def run(n=100000, num_rivers=20000, N=10, repeat=3):
+    """Compare the time to find the top N rivers"""
+
+    stations = example_stations(n, num_rivers)
+    table = StationTable.from_stations(stations)
+    assert rivers_by_station_number(stations, N) == rivers_by_station_number_sorted(stations, N)
+
+    for name, function in (("sort (list)", lambda: rivers_by_station_number_sorted(stations, N)),
+                           ("heap (list)", lambda: rivers_by_station_number(stations, N)),
+                           ("heap (table, cached)", lambda: rivers_by_station_number(table, N))):
+        t = min(timeit.repeat(function, number=1, repeat=repeat))
+        print("{:22} {:10.1f} ms".format(name, t * 1000))
+
+
+if __name__ == "__main__":
+    print("*** Benchmark: rivers_by_station_number (100000 stations) ***")
+    run()
@@ -0,0 +1,73 @@
+"""Benchmark of loading the station list from the JSON station data cache
+and from the compact binary (NumPy .npz) station cache"""
+
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from floodsystem import datafetcher  # noqa: E402
+from floodsystem.stationdata import extract_station_fields, _build_stations_from_fields  # noqa: E402
+
+
+def example_station_data(n):
+    """Return station data for n stations in the format returned by the
+    Environment agency (including fields that are not used)"""
+
+    items = []
+    for i in range(n):
+        station_id = "http://environment.data.gov.uk/flood-monitoring/id/stations/{}".format(i)
+        items.append({
+            "@id": station_id,
+            "RLOIid": str(i),
+            "catchmentName": "Catchment {}".format(i % 100),
+            "dateOpened": "1994-01-01",
+            "easting": random.randint(100000, 600000),
+            "northing": random.randint(100000, 600000),
+            "label": "Station {}".format(i),
+            "lat": random.uniform(50, 55),
+            "long": random.uniform(-5, 1),
+            "measures": [{"@id": station_id.replace("stations", "measures") + "-level-stage-i-15_min-m",
+                          "label": "Water Level", "parameter": "level", "parameterName": "Water Level",
+                          "period": 900, "qualifier": "Stage", "unitName": "m"}],
+            "notation": str(i),
+            "riverName": "River {}".format(i % 900),
+            "stageScale": {"@id": station_id + "/stageScale", "datum": 0.0, "highestRecent": {"value": 2.0},
+                           "maxOnRecord": {"value": 3.0}, "minOnRecord": {"value": 0.0},
+                           "scaleMax": 3, "typicalRangeHigh": random.uniform(1, 2),
+                           "typicalRangeLow": random.uniform(0, 1)},
+            "status": "http://environment.data.gov.uk/flood-monitoring/def/core/statusActive",
+            "town": "Town {}".format(i % 2000),
+            "wiskiID": str(i)})
+    return {"@context": "", "meta": {}, "items": items}
+
+
+def run(n=5000, repeat=5):
+    """Compare the time to build the station list from each cache format"""
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_file = os.path.join(directory, 'station_data.json')
+        npz_file = os.path.join(directory, 'station_data.npz')
+
+        data = example_station_data(n)
+        datafetcher.dump(data, json_file)
+        datafetcher.dump_columns(extract_station_fields(data), npz_file)
+
+        def build_from_json():
+            return _build_stations_from_fields(extract_station_fields(datafetcher.load(json_file)))
+
+        def build_from_npz():
+            return _build_stations_from_fields(datafetcher.load_columns(npz_file))
+
+        for name, function, filename in (("JSON", build_from_json, json_file),
+                                         ("npz", build_from_npz, npz_file)):
+            t = min(timeit.repeat(function, number=1, repeat=repeat))
+            print("{:5} {:8.1f} ms  ({:.0f} kB)".format(name, t * 1000, os.path.getsize(filename) / 1024))
+
+
+if __name__ == "__main__":
+    print("*** Benchmark: station cache formats ***")
+    run()
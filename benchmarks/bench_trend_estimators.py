@@ -0,0 +1,94 @@
+"""Benchmark of the trend estimators used for the rate of water level
+rise, with a report of how well each agrees with the degree 4 polynomial
+method.
+
+Usage: python bench_trend_estimators.py [archive directory]
+
+Recorded level data is read from a readings archive (see
+floodsystem.archive) if its directory is given (the last 2 days of each
+measure are used). Otherwise synthetic level data is used."""
+
+import os
+import sys
+import timeit
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from floodsystem.analysis import TREND_ESTIMATORS  # noqa: E402
+from floodsystem.archive import ReadingsArchive  # noqa: E402
+
+
+def recorded_histories(directory, days=2):
+    """Return list of (times, levels) tuples of the last few days of
+    readings for each measure in a readings archive (skipping measures
+    with missing levels)"""
+
+    archive = ReadingsArchive(directory)
+    histories = []
+    for measure_id in sorted(archive.measure_ids()):
+        times, levels = archive.read(measure_id)
+        if len(times) == 0:
+            continue
+        times, levels = archive.read(measure_id, start=times[-1] - days)
+        levels = np.array(levels, dtype=float)
+        if len(times) > 1 and not np.isnan(levels).any():
+            histories.append((np.array(times), levels))
+    return histories
+
+
+def synthetic_histories(n, seed=0):
+    """Return list of n (times, levels) tuples of synthetic level data for
+    2 days at 15 minute intervals: a trend plus a daily cycle, noise and
+    occasional spikes"""
+
+    rng = np.random.default_rng(seed)
+    times = 19000 + np.arange(192) / 96
+    histories = []
+    for _ in range(n):
+        levels = (rng.normal(1, 0.5) + rng.normal(0, 0.1) * (times - times[0])
+                  + rng.uniform(0, 0.05) * np.sin(2 * np.pi * times + rng.uniform(0, 2 * np.pi))
+                  + rng.normal(0, 0.01, len(times)))
+        spikes = rng.random(len(times)) < 0.005
+        levels[spikes] += rng.normal(0, 0.5, spikes.sum())
+        histories.append((times, levels))
+    return histories
+
+
+def rise_class(rise):
+    """Return how a level rise affects the flood risk rating (-1 if falling,
+    1 if rising above the threshold, 0 otherwise)"""
+    return -1 if rise < 0 else (1 if rise > 0.1 else 0)
+
+
+def run(histories, repeat=3):
+    """Time each trend estimator on all histories, and compare its
+    results with those of the polynomial method"""
+
+    results = {}
+    print("{:10} {:>10} {:>10} {:>10} {:>12}".format("estimator", "time (ms)", "corr", "median |d|",
+                                                     "rating agree"))
+    for name, estimator in TREND_ESTIMATORS.items():
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', np.exceptions.RankWarning)
+            t = min(timeit.repeat(lambda: [estimator(times, levels) for times, levels in histories],
+                                  number=1, repeat=repeat))
+            results[name] = np.array([estimator(times, levels) for times, levels in histories], dtype=float)
+
+        reference = results['polyfit']
+        difference = np.abs(results[name] - reference)
+        agree = np.mean([rise_class(a) == rise_class(b) for a, b in zip(results[name], reference)])
+        print("{:10} {:10.1f} {:10.3f} {:10.4f} {:11.1%}".format(
+            name, t * 1000, np.corrcoef(results[name], reference)[0, 1], np.median(difference), agree))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        histories = recorded_histories(sys.argv[1])
+        print("*** Benchmark: trend estimators ({} recorded histories) ***".format(len(histories)))
+    else:
+        histories = synthetic_histories(2000)
+        print("*** Benchmark: trend estimators ({} synthetic histories) ***".format(len(histories)))
+    run(histories)
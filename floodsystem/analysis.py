@@ -2,26 +2,239 @@
 
 from matplotlib import dates as date
 import numpy as np
+from numpy.polynomial import Polynomial
+
+def date_nums(dates):
+    """For a list or array of dates (dates), returns a NumPy array of the dates as Matplotlib date numbers
+    (days). Dates which are already numbers are returned unchanged."""
+
+    x = np.asarray(dates)
+    if x.dtype.kind != 'f':
+        x = date.date2num(dates)
+    return np.asarray(x, dtype=np.float64)
 
 def polyfit(dates, levels, p):
     """For a given set of dates and levels for a station, obtains a polynomial approximation of the curve
     (change in level with respect to time). The polynomial will be of degree p. Please note that the first
     data point in the list will be treated as x=0 (vertical intercept) - d0 is the offset of the horizontal 
-    axis as a result."""
+    axis as a result. Dates can be datetimes or Matplotlib date numbers (as returned by
+    fetch_measure_levels with as_array=True).
+
+    The polynomial is a numpy.polynomial.Polynomial, fitted with the dates scaled to [-1, 1] so that the
+    fit is well conditioned (calling it, or its derivative from .deriv(), takes unscaled x values).
+    Missing levels (None or NaN) are ignored, and the degree is reduced if there are too few dates for
+    degree p. Returns None if the polynomial cannot be fitted."""
 
     #If inconsistent data, return None
-    if dates == None or levels == None:
+    if dates is None or levels is None:
         return None
 
-    #Convert dates to values 
-    x = date.date2num(dates)
+    #Convert dates to values, and levels to an array (missing levels are NaN)
+    x = date_nums(dates)
+    y = level_array(levels)
+    if len(x) == 0 or len(x) != len(y):
+        return None
 
     #Calculate offset of dates (first date treated as 0 point)
     d0 = x[0]
 
-    #Calculate polynomial (using offset d0) and convert to numpy.poly1d object
-    p_coeff = np.polyfit(x - d0, levels, p)
-    poly = np.poly1d(p_coeff)
+    #Only use dates with levels
+    valid = np.isfinite(x) & np.isfinite(y)
+    x, y = x[valid] - d0, y[valid]
+
+    #Reduce degree if there are not enough distinct dates
+    p = min(p, len(np.unique(x)) - 1)
+    if p < 0:
+        return None
+    if p == 0:
+        return Polynomial([y.mean()]), d0
+
+    #Calculate polynomial (using offset d0)
+    try:
+        poly = Polynomial.fit(x, y, p)
+    except (np.linalg.LinAlgError, ValueError):
+        return None
 
     #Return polynomial and offset
     return poly, d0
+
+def level_array(levels):
+    """For a list or array of levels (levels), returns a NumPy array of the levels, with NaN for missing
+    levels (None, or other values which are not numbers)"""
+
+    try:
+        return np.array(levels, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([level if isinstance(level, (int, float)) else np.nan for level in levels],
+                        dtype=np.float64)
+
+def evaluate_fit(fit, dates):
+    """For a (polynomial, d0) tuple returned by polyfit (fit) and a list or array of dates (dates), returns
+    an array of the values of the polynomial at the dates"""
+
+    poly, d0 = fit
+    return poly(date_nums(dates) - d0)
+
+def pad_histories(histories):
+    """For a list of (dates, levels) tuples (histories), which can have different lengths, returns a
+    tuple of 2D arrays of the dates (as Matplotlib date numbers) and levels, with one row per history
+    padded with NaN to the length of the longest history, and an array of the length of each history."""
+
+    lengths = np.array([min(len(dates), len(levels)) for dates, levels in histories], dtype=int)
+    width = lengths.max() if len(lengths) else 0
+    times = np.full((len(histories), width), np.nan)
+    values = np.full((len(histories), width), np.nan)
+    for i, (dates, levels) in enumerate(histories):
+        if lengths[i]:
+            times[i, :lengths[i]] = date_nums(dates)[:lengths[i]]
+            values[i, :lengths[i]] = np.asarray(levels, dtype=float)[:lengths[i]]
+
+    return times, values, lengths
+
+def polyfit_batch(times, values, lengths, p):
+    """Fits polynomials of degree p to many stations' levels at once. times and values are 2D arrays
+    with one row per station, of which the first lengths[i] entries of row i are used (as returned by
+    pad_histories). Missing (NaN) levels are ignored, as for polyfit. To keep the fits well conditioned,
+    the dates of each row are scaled to x = (date - d0) / span, where d0 is the first date with a level
+    and span the time between the first and last dates with levels.
+
+    Returns a tuple of the coefficients (one row per station, lowest degree first, in terms of x) and
+    arrays of d0 and span. Coefficients are NaN for rows with fewer than two levels, or with a span of
+    zero."""
+
+    n = len(times)
+    used = (np.arange(times.shape[1]) < lengths[:, np.newaxis]) & ~np.isnan(values) & ~np.isnan(times)
+
+    #Rows which can be fitted
+    valid = np.count_nonzero(used, axis=1) >= 2
+    d0 = np.full(n, np.nan)
+    span = np.full(n, np.nan)
+    if valid.any():
+        d0[valid] = np.where(used[valid], times[valid], np.inf).min(axis=1)
+        span[valid] = np.where(used[valid], times[valid], -np.inf).max(axis=1) - d0[valid]
+    valid &= span > 0
+
+    #Scaled dates and levels, with unused entries set to zero (so that they do not affect the fits)
+    used &= valid[:, np.newaxis]
+    with np.errstate(invalid='ignore'):
+        x = np.where(used, (times - d0[:, np.newaxis]) / span[:, np.newaxis], 0)
+    y = np.where(used, values, 0)
+
+    #Solve all least-squares problems using QR factorisations of the Vandermonde matrices
+    coeffs = np.full((n, p + 1), np.nan)
+    if valid.any():
+        vander = x[valid, :, np.newaxis] ** np.arange(p + 1)
+        vander[~used[valid]] = 0
+        q, r = np.linalg.qr(vander)
+        qty = np.einsum('nmk,nm->nk', q, y[valid])
+
+        #Solve triangular systems, except for rank deficient rows (fewer distinct dates than
+        #coefficients), which are fitted separately with the degree reduced (as for polyfit)
+        diag = np.abs(np.diagonal(r, axis1=1, axis2=2))
+        deficient = np.any(diag <= 1e-10 * np.maximum(diag.max(axis=1, keepdims=True), 1e-300), axis=1)
+        fitted = np.full((len(q), p + 1), np.nan)
+        if (~deficient).any():
+            fitted[~deficient] = np.linalg.solve(r[~deficient], qty[~deficient, :, np.newaxis])[..., 0]
+        x_valid, y_valid, used_valid = x[valid], y[valid], used[valid]
+        for i in np.flatnonzero(deficient):
+            degree = min(p, len(np.unique(x_valid[i, used_valid[i]])) - 1)
+            fitted[i] = 0
+            fitted[i, :degree + 1] = np.linalg.lstsq(vander[i, :, :degree + 1], y_valid[i], rcond=None)[0]
+        coeffs[valid] = fitted
+
+    return coeffs, d0, span
+
+def mean_gradients(histories, p=4, block_size=1024):
+    """For a list of (dates, levels) tuples (histories), fits a polynomial of degree p to each history
+    (see polyfit_batch), and returns an array of the average gradient of each polynomial (in levels per
+    day) evaluated at each of the dates, as for polyfit_slope, or NaN if the history cannot be fitted.
+    In terms of the scaled dates x, the gradient is the sum of k * c_k * x^(k - 1) divided by the span,
+    so its average only needs the averages of the powers of x. Histories are fitted in blocks of
+    block_size, to limit the size of temporary arrays."""
+
+    gradients = np.full(len(histories), np.nan)
+    for i in range(0, len(histories), block_size):
+        times, values, lengths = pad_histories(histories[i:i + block_size])
+        coeffs, d0, span = polyfit_batch(times, values, lengths, p)
+
+        #Average of x^(k - 1) over the dates with levels, for k = 1 to p
+        used = (np.arange(times.shape[1]) < lengths[:, np.newaxis]) & ~np.isnan(values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x = (times - d0[:, np.newaxis]) / span[:, np.newaxis]
+        powers = np.where(used[:, :, np.newaxis], x[:, :, np.newaxis] ** np.arange(p), 0)
+        mean_powers = powers.sum(axis=1) / np.maximum(used.sum(axis=1), 1)[:, np.newaxis]
+
+        gradients[i:i + block_size] = (coeffs[:, 1:] * np.arange(1, p + 1) * mean_powers).sum(axis=1) / span
+
+    return gradients
+
+def polyfit_slope(times, levels, p=4):
+    """For arrays of date numbers (times) and levels, returns the average gradient (levels per day) of a
+    polynomial fit of degree p (see polyfit), evaluated at each of the dates"""
+
+    fit = polyfit(times, levels, p)
+    if fit is None:
+        return None
+    poly, d0 = fit
+    return float(np.average(poly.deriv()(times - d0)))
+
+def linear_slope(times, levels):
+    """For arrays of date numbers (times) and levels, returns the slope (levels per day) of the least
+    squares straight line through the levels, or None if all dates are the same"""
+
+    t = times - times.mean()
+    denominator = np.dot(t, t)
+    if denominator == 0:
+        return None
+    return float(np.dot(t, levels - levels.mean()) / denominator)
+
+def theil_sen_slope(times, levels, max_points=50):
+    """For arrays of date numbers (times) and levels, returns the Theil-Sen estimate of the slope (levels
+    per day): the median of the slopes between all pairs of readings, which is robust to outliers. To
+    keep the cost linear in the number of readings, at most max_points evenly spaced readings are used.
+    Returns None if all dates are the same."""
+
+    if len(times) > max_points:
+        sample = np.linspace(0, len(times) - 1, max_points).round().astype(int)
+        times, levels = times[sample], levels[sample]
+
+    i, j = np.triu_indices(len(times), k=1)
+    dt = times[j] - times[i]
+    nonzero = dt != 0
+    if not nonzero.any():
+        return None
+    return float(np.median((levels[j] - levels[i])[nonzero] / dt[nonzero]))
+
+def ew_slope(times, levels, halflife=0.5):
+    """For arrays of date numbers (times) and levels, returns the slope (levels per day) of the weighted
+    least squares straight line through the levels, with weights that halve for every halflife days
+    before the latest reading, so that recent readings count for more. Returns None if all dates are
+    the same."""
+
+    weights = 0.5 ** ((times.max() - times) / halflife)
+    t = times - np.average(times, weights=weights)
+    denominator = np.dot(weights * t, t)
+    if denominator == 0:
+        return None
+    return float(np.dot(weights * t, levels - np.average(levels, weights=weights)) / denominator)
+
+# Trend estimators, which return the slope of levels (levels per day) for arrays of date numbers and
+# levels, by name
+TREND_ESTIMATORS = {
+    'polyfit': polyfit_slope,
+    'linear': linear_slope,
+    'theil_sen': theil_sen_slope,
+    'ew': ew_slope,
+}
+
+def get_trend_estimator(estimator):
+    """Returns the trend estimator function for the name of one of TREND_ESTIMATORS (functions are
+    returned unchanged)"""
+
+    if callable(estimator):
+        return estimator
+    try:
+        return TREND_ESTIMATORS[estimator]
+    except KeyError:
+        raise ValueError("Unknown trend estimator {!r} (expected one of {})".format(
+            estimator, ", ".join(TREND_ESTIMATORS))) from None
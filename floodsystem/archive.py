@@ -0,0 +1,143 @@
+"""This module provides an on-disk archive of readings for measures,
+which can be read as memory-mapped NumPy arrays for analysing long
+histories
+
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+from matplotlib import dates as date
+
+
+def _date_num(d):
+    """Convert a datetime to a Matplotlib date number (numbers are
+    returned unchanged)"""
+    if isinstance(d, (int, float, np.number)):
+        return d
+    return date.date2num(d)
+
+
+class ReadingsArchive:
+    """This class represents an append-only archive of readings. For each
+    measure, reading times (as float64 Matplotlib date numbers, i.e. days)
+    and values (as float32, NaN if missing) are stored in two binary
+    files in the archive directory, in increasing order of time."""
+
+    def __init__(self, directory):
+
+        self._directory = directory
+        self._lock = threading.Lock()
+
+        # Measure ids stored in the archive
+        try:
+            with open(self._index_file(), 'r') as f:
+                self._measure_ids = set(json.load(f))
+        except FileNotFoundError:
+            self._measure_ids = set()
+
+    def __contains__(self, measure_id):
+        return measure_id in self._measure_ids
+
+    def measure_ids(self):
+        """Returns a set of the measure ids stored in the archive"""
+        return set(self._measure_ids)
+
+    def _index_file(self):
+        return os.path.join(self._directory, 'index.json')
+
+    def _measure_files(self, measure_id):
+        name = os.path.join(self._directory, hashlib.sha1(measure_id.encode('utf-8')).hexdigest())
+        return name + '.time', name + '.value'
+
+    def _map(self, filename, dtype):
+        """Memory-map a file as a read-only array (empty if file is empty
+        or does not exist)"""
+        try:
+            if os.path.getsize(filename) >= np.dtype(dtype).itemsize:
+                return np.memmap(filename, dtype=dtype, mode='r')
+        except FileNotFoundError:
+            pass
+        return np.empty(0, dtype=dtype)
+
+    def _arrays(self, measure_id):
+        """Return memory-mapped arrays of times and values for a measure"""
+        time_file, value_file = self._measure_files(measure_id)
+        times = self._map(time_file, np.float64)
+        values = self._map(value_file, np.float32)
+
+        # If an append was interrupted, ignore the incomplete reading
+        n = min(len(times), len(values))
+        return times[:n], values[:n]
+
+    def append(self, measure_id, dates, levels):
+        """Append readings for a measure, given as dates and levels (None
+        or NaN if missing), as returned by fetch_measure_levels. Only
+        readings later than the last archived reading are added. Returns
+        the number of readings added."""
+
+        if len(dates) == 0:
+            return 0
+
+        # Convert to arrays sorted by time
+        times = np.asarray(dates)
+        if times.dtype.kind != 'f':
+            times = date.date2num(dates)
+        times = np.asarray(times, dtype=np.float64)
+        values = np.array(levels, dtype=np.float32)
+        order = np.argsort(times, kind='stable')
+        times, values = times[order], values[order]
+
+        with self._lock:
+            time_file, value_file = self._measure_files(measure_id)
+
+            # If an earlier append was interrupted, remove the incomplete
+            # readings so that the files stay aligned
+            if measure_id in self._measure_ids:
+                n = min(os.path.getsize(time_file) // 8, os.path.getsize(value_file) // 4)
+                os.truncate(time_file, n * 8)
+                os.truncate(value_file, n * 4)
+
+            # Only keep readings after the last archived reading
+            archived_times, _ = self._arrays(measure_id)
+            if len(archived_times):
+                keep = times > archived_times[-1]
+                times, values = times[keep], values[keep]
+            if len(times) == 0:
+                return 0
+
+            # Append to files (values first, so an interrupted append
+            # never has more times than values)
+            os.makedirs(self._directory, exist_ok=True)
+            with open(value_file, 'ab') as f:
+                f.write(values.tobytes())
+            with open(time_file, 'ab') as f:
+                f.write(times.tobytes())
+
+            if measure_id not in self._measure_ids:
+                self._measure_ids.add(measure_id)
+                with open(self._index_file(), 'w') as f:
+                    json.dump(sorted(self._measure_ids), f)
+
+        return len(times)
+
+    def read(self, measure_id, start=None, end=None):
+        """Returns arrays of the times (Matplotlib date numbers) and
+        values of readings for a measure, from start up to (but not
+        including) end. start and end are datetimes or date numbers, and
+        can be None for no limit. The arrays are read-only slices of
+        memory-mapped files, so no data is copied."""
+
+        times, values = self._arrays(measure_id)
+
+        # Find range of readings using binary search on the times
+        i0, i1 = 0, len(times)
+        if start is not None:
+            i0 = np.searchsorted(times, _date_num(start), side='left')
+        if end is not None:
+            i1 = np.searchsorted(times, _date_num(end), side='left')
+
+        return times[i0:i1], values[i0:i1]
@@ -6,26 +6,186 @@ latest time history level data
 
 """
 
+import codecs
+import contextlib
 import datetime
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import dateutil.parser
+import numpy as np
 import requests
+from matplotlib import dates as date
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .readingscache import MAX_MEASURES, MAX_READINGS, ReadingsCache
+
+
+# Shared HTTP session used for all requests (created on first use, see
+# get_session) and the options used to create it
+_session = None
+_session_options = {'pool_size': 16, 'timeout': 30, 'retries': 3, 'backoff_factor': 0.5}
+_session_lock = threading.Lock()
+
+# Counters for requests made through the shared session
+# (connections opened before the counters were last reset are excluded)
+_session_stats = {'requests': 0, 'latency': 0.0, 'connections_offset': 0}
+
+
+def configure_session(pool_size=16, timeout=30, retries=3, backoff_factor=0.5):
+    """Configure the shared HTTP session used for all requests.
+
+    pool_size is the maximum number of kept-alive connections per host,
+    timeout is the connect/read timeout in seconds, and failed requests
+    (connection errors and 429/5xx responses) are retried up to retries
+    times, waiting backoff_factor * 2^n seconds between attempts. The
+    current session is closed and a new one is created on next use.
+
+    """
+
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session_stats['connections_offset'] -= _count_connections()
+            _session.close()
+        _session = None
+        _session_options.update(pool_size=pool_size, timeout=timeout, retries=retries,
+                                backoff_factor=backoff_factor)
+
+
+def get_session():
+    """Return the shared HTTP session, creating it if required. The
+    session keeps connections alive and pools them, so repeated
+    requests to the Environment Agency service reuse connections.
+
+    """
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=_session_options['retries'],
+                          backoff_factor=_session_options['backoff_factor'],
+                          status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=frozenset(['GET', 'HEAD']))
+            adapter = HTTPAdapter(pool_connections=_session_options['pool_size'],
+                                  pool_maxsize=_session_options['pool_size'],
+                                  max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+            _session = session
+        return _session
+
+
+def _count_connections():
+    """Return the number of connections opened by the shared session's
+    connection pools (the session lock must be held)"""
+
+    connections = 0
+    if _session is not None:
+        # The same adapter is mounted for both http and https
+        for adapter in {id(a): a for a in _session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                connections += pools[key].num_connections
+    return connections
+
+
+def session_stats():
+    """Return a dictionary of counters for the shared HTTP session:
+    number of requests, number of connections opened, number of
+    requests that reused an open connection, and the total and mean
+    request latency (in seconds).
+
+    """
+
+    with _session_lock:
+        requests_made = _session_stats['requests']
+        latency = _session_stats['latency']
+        connections = _count_connections() - _session_stats['connections_offset']
+
+    return {'requests': requests_made,
+            'connections': connections,
+            'reused': max(requests_made - connections, 0),
+            'latency': latency,
+            'mean_latency': latency / requests_made if requests_made else 0.0}
+
+
+def reset_session_stats():
+    """Reset the request and latency counters for the shared HTTP session"""
+    with _session_lock:
+        _session_stats['requests'] = 0
+        _session_stats['latency'] = 0.0
+        _session_stats['connections_offset'] = _count_connections()
+
+
+def _get(url, headers=None, stream=False):
+    """Make a GET request to url using the shared session and return the
+    response, updating the session counters. If stream is True, the
+    response content is not downloaded until it is read."""
+
+    # Make request using the shared session, timing the request
+    start = time.perf_counter()
+    r = get_session().get(url, headers=headers, stream=stream, timeout=_session_options['timeout'])
+    elapsed = time.perf_counter() - start
+
+    # Update counters
+    with _session_lock:
+        _session_stats['requests'] += 1
+        _session_stats['latency'] += elapsed
+
+    return r
 
 
 def fetch(url):
     """Fetch data from url and return fetched JSON object"""
-    r = requests.get(url)
+    r = _get(url)
     data = r.json()
     return data
 
 
+def fetch_conditional(url, etag=None, last_modified=None):
+    """Fetch data from url, unless it is unchanged since it was fetched
+    with the given ETag (etag) or Last-Modified time (last_modified).
+    Return the fetched JSON object (None if unchanged) and a dictionary
+    with the 'etag' and 'last_modified' of the response.
+
+    """
+
+    # Add headers for conditional request
+    headers = {}
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    if last_modified is not None:
+        headers['If-Modified-Since'] = last_modified
+
+    r = _get(url, headers)
+    validators = {'etag': r.headers.get('ETag', etag),
+                  'last_modified': r.headers.get('Last-Modified', last_modified)}
+
+    # Data is unchanged
+    if r.status_code == 304:
+        return None, validators
+
+    data = r.json()
+    return data, validators
+
+
 def dump(data, filename):
     """Save JSON object to file"""
-    f = open(filename, 'w')
+
+    # Write to a temporary file first, so that the file is replaced
+    # atomically (it may be read while being refreshed)
+    tmp_filename = '{}.{}.tmp'.format(filename, threading.get_ident())
+    f = open(tmp_filename, 'w')
     data = json.dump(data, f)
     f.close()
+    os.replace(tmp_filename, filename)
 
 
 def load(filename):
@@ -36,7 +196,333 @@ def load(filename):
     return data
 
 
-def fetch_station_data(use_cache=True):
+def iter_json_items(chunks, key='items'):
+    """For an iterable of text chunks (chunks) making up a JSON object,
+    yield the elements of the array stored under key (default 'items')
+    as they are parsed, so that the whole object never needs to be held
+    in memory. Other values in the object are parsed and discarded."""
+
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    eof = False
+
+    def read_more():
+        # Append next chunk to buffer, dropping text already parsed.
+        # Returns False at end of input.
+        nonlocal buf, pos, eof
+        for chunk in chunks:
+            if chunk:
+                buf = buf[pos:] + chunk
+                pos = 0
+                return True
+        eof = True
+        return False
+
+    def next_char():
+        # Skip whitespace and return next character (None at end of input)
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not read_more():
+                return None
+
+    def expect(chars):
+        # Consume next character, which must be one of chars
+        nonlocal pos
+        c = next_char()
+        if c is None or c not in chars:
+            raise ValueError("Invalid JSON: expected one of {!r} at {!r}".format(chars, buf[pos:pos + 20]))
+        pos += 1
+        return c
+
+    def decode_value():
+        # Decode next JSON value, reading more input until a complete
+        # value is decoded (i.e. followed by a delimiter, so a number is
+        # not cut short by the end of the buffer)
+        nonlocal pos
+        next_char()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                if eof or (end < len(buf) and (buf[end].isspace() or buf[end] in ',:]}')):
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            read_more()
+
+    expect('{')
+    if next_char() == '}':
+        return
+    while True:
+        name = decode_value()
+        expect(':')
+        if name == key:
+            # Yield elements of array as they are parsed
+            expect('[')
+            if next_char() == ']':
+                pos += 1
+            else:
+                while True:
+                    yield decode_value()
+                    if expect(',]') == ']':
+                        break
+        else:
+            decode_value()
+        if expect(',}') == '}':
+            return
+
+
+def load_items(filename, key='items', chunk_size=65536):
+    """Load the elements of the array stored under key (default 'items')
+    in a JSON object saved to file, yielding them one at a time as they
+    are parsed"""
+
+    with open(filename, 'r') as f:
+        yield from iter_json_items(iter(lambda: f.read(chunk_size), ''), key)
+
+
+# Version of the binary columns file format (see dump_columns)
+COLUMNS_FORMAT_VERSION = 1
+
+
+def dump_columns(columns, filename):
+    """Save a dictionary of equal length columns to a compact binary
+    (NumPy .npz) file. Each column is a list of floats, or a list of
+    strings (which may include None values). The file has a version
+    header so that files in an old format are not loaded."""
+
+    arrays = {'__version__': np.array(COLUMNS_FORMAT_VERSION)}
+    for name, values in columns.items():
+        if all(isinstance(value, (str, type(None))) for value in values):
+            # Store strings as a single UTF-8 buffer, the offsets of each
+            # string in the buffer and a mask of None values
+            encoded = [b'' if value is None else value.encode('utf-8') for value in values]
+            arrays[name + '.data'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+            arrays[name + '.offsets'] = np.cumsum([0] + [len(e) for e in encoded], dtype=np.int64)
+            arrays[name + '.none'] = np.array([value is None for value in values], dtype=bool)
+        else:
+            arrays[name] = np.array(values, dtype=np.float64)
+
+    # Write to a temporary file first, so that the file is replaced
+    # atomically
+    tmp_filename = '{}.{}.tmp'.format(filename, threading.get_ident())
+    with open(tmp_filename, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_filename, filename)
+
+
+def load_columns(filename):
+    """Load a dictionary of columns saved by dump_columns. Float columns
+    are returned as NumPy arrays and string columns as lists. Raises
+    ValueError if the file is in a different format version."""
+
+    with np.load(filename) as arrays:
+        if '__version__' not in arrays or int(arrays['__version__']) != COLUMNS_FORMAT_VERSION:
+            raise ValueError("Unsupported columns file format: {}".format(filename))
+
+        columns = {}
+        for key in arrays.files:
+            if key == '__version__':
+                continue
+            name, _, part = key.partition('.')
+            if not part:
+                columns[name] = arrays[key]
+            elif part == 'data':
+                data = arrays[key].tobytes()
+                offsets = arrays[name + '.offsets'].tolist()
+                none = arrays[name + '.none'].tolist()
+                columns[name] = [None if none[i] else data[offsets[i]:offsets[i + 1]].decode('utf-8')
+                                 for i in range(len(none))]
+
+    return columns
+
+
+# Maximum age of the cached station and level data before they are
+# revalidated with the Environment Agency service
+STATION_DATA_MAX_AGE = datetime.timedelta(days=1)
+LEVEL_DATA_MAX_AGE = datetime.timedelta(minutes=15)
+
+# Cache files currently being revalidated in the background
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+
+def _load_cache_info(cache_file):
+    """Load the time a cache file was fetched and its ETag/Last-Modified
+    validators. Falls back to the file modification time if no
+    information was saved."""
+
+    try:
+        return load(cache_file + '.info')
+    except (FileNotFoundError, ValueError):
+        return {'fetched': os.path.getmtime(cache_file), 'etag': None, 'last_modified': None}
+
+
+def _revalidate(url, cache_file, info=None):
+    """Fetch data from url, using a conditional request if cache
+    information (info) is given, and update the cache file. Return the
+    fetched data, or None if unchanged."""
+
+    if info is None:
+        data, validators = fetch_conditional(url)
+    else:
+        data, validators = fetch_conditional(url, info['etag'], info['last_modified'])
+
+    if data is not None:
+        dump(data, cache_file)
+    validators['fetched'] = time.time()
+    dump(validators, cache_file + '.info')
+
+    return data
+
+
+def _revalidate_stream(url, cache_file, info=None, chunk_size=65536):
+    """Fetch data from url as _revalidate, but yield the items in the
+    fetched data as they are downloaded and parsed. The downloaded data
+    is written to the cache file as it arrives. If the data is unchanged,
+    items are loaded from the cache file."""
+
+    # Add headers for conditional request
+    etag = info['etag'] if info is not None else None
+    last_modified = info['last_modified'] if info is not None else None
+    headers = {}
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    if last_modified is not None:
+        headers['If-Modified-Since'] = last_modified
+
+    with _get(url, headers, stream=True) as r:
+        # Keep the previous validators if the response does not include
+        # them (as is common for 304 responses)
+        validators = {'etag': r.headers.get('ETag', etag),
+                      'last_modified': r.headers.get('Last-Modified', last_modified)}
+
+        if r.status_code == 304:
+            yield from load_items(cache_file)
+        else:
+            # Save downloaded data to a temporary file while parsing it,
+            # replacing the cache file once the download is complete
+            tmp_file = '{}.{}.tmp'.format(cache_file, threading.get_ident())
+            text_decoder = codecs.getincrementaldecoder(r.encoding or 'utf-8')()
+
+            def chunks(f):
+                for chunk in r.iter_content(chunk_size):
+                    f.write(chunk)
+                    yield text_decoder.decode(chunk)
+                yield text_decoder.decode(b'', final=True)
+
+            try:
+                with open(tmp_file, 'wb') as f:
+                    yield from iter_json_items(chunks(f))
+            except BaseException:
+                # Download failed or was not read to the end, so keep the
+                # old cache file
+                os.remove(tmp_file)
+                raise
+            os.replace(tmp_file, cache_file)
+
+    validators['fetched'] = time.time()
+    dump(validators, cache_file + '.info')
+
+
+def _revalidate_in_background(url, cache_file, info):
+    """Revalidate the cache file in a background thread (unless already
+    being revalidated)"""
+
+    with _revalidating_lock:
+        if cache_file in _revalidating:
+            return
+        _revalidating.add(cache_file)
+
+    def run():
+        try:
+            _revalidate(url, cache_file, info)
+        except Exception:
+            # Keep serving the stale copy; revalidation is retried on
+            # next use
+            pass
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(cache_file)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _fetch_cached(url, cache_file, use_cache, max_age, stale_while_revalidate, stream=False):
+    """Return data from url, using the cache file if use_cache is True.
+
+    Cached data older than max_age (None for no expiry) is revalidated
+    with a conditional request, so it is only downloaded again if it has
+    changed. If stale_while_revalidate is True, expired data is returned
+    immediately and revalidated in the background.
+
+    If stream is True, return a generator of the items in the data, which
+    are parsed incrementally as they are read from the cache file or
+    downloaded.
+
+    """
+
+    if stream:
+        return _fetch_cached_stream(url, cache_file, use_cache, max_age, stale_while_revalidate)
+
+    if use_cache:
+        try:
+            # Attempt to load from file
+            data = load(cache_file)
+        except FileNotFoundError:
+            data = None
+
+        if data is not None:
+            info = _load_cache_info(cache_file)
+            age = time.time() - info['fetched']
+
+            # Cached data has not expired
+            if max_age is None or age <= max_age.total_seconds():
+                return data
+
+            # Cached data has expired, so revalidate
+            if stale_while_revalidate:
+                _revalidate_in_background(url, cache_file, info)
+                return data
+            new_data = _revalidate(url, cache_file, info)
+            return data if new_data is None else new_data
+
+    # Fetch and dump to file
+    return _revalidate(url, cache_file)
+
+
+def _fetch_cached_stream(url, cache_file, use_cache, max_age, stale_while_revalidate):
+    """Generator of items in data from url (see _fetch_cached)"""
+
+    if use_cache and os.path.exists(cache_file):
+        info = _load_cache_info(cache_file)
+        age = time.time() - info['fetched']
+
+        # Cached data has not expired
+        if max_age is None or age <= max_age.total_seconds():
+            yield from load_items(cache_file)
+            return
+
+        # Cached data has expired, so revalidate
+        if stale_while_revalidate:
+            _revalidate_in_background(url, cache_file, info)
+            yield from load_items(cache_file)
+            return
+        yield from _revalidate_stream(url, cache_file, info)
+        return
+
+    # Fetch and dump to file
+    yield from _revalidate_stream(url, cache_file)
+
+
+def fetch_station_data(use_cache=True, max_age=STATION_DATA_MAX_AGE, stale_while_revalidate=False, stream=False):
     """Fetch data from Environment agency for all active river level
     monitoring stations via a REST API and return retrieved data as a
     JSON object.
@@ -46,6 +532,15 @@ def fetch_station_data(use_cache=True):
     retrieval over the Internet and avoids excessive calls to the
     Environment Agency service.
 
+    Cached data older than max_age is revalidated with the service and
+    only downloaded again if it has changed. If stale_while_revalidate
+    is True, expired cached data is returned without waiting for it to
+    be revalidated.
+
+    If stream is True, a generator of the station items in the data is
+    returned instead, which parses the items incrementally as they are
+    downloaded (or read from the cache file).
+
     """
 
     # URL for retrieving data for active stations with river level
@@ -62,24 +557,18 @@ def fetch_station_data(use_cache=True):
 
     # Attempt to load station data from file, otherwise fetch over
     # Internet
-    if use_cache:
-        try:
-            # Attempt to load from file
-            data = load(cache_file)
-        except FileNotFoundError:
-            # If load from file fails, fetch and dump to file
-            data = fetch(url)
-            dump(data, cache_file)
-    else:
-        # Fetch and dump to file
-        data = fetch(url)
-        dump(data, cache_file)
+    return _fetch_cached(url, cache_file, use_cache, max_age, stale_while_revalidate, stream)
 
-    return data
 
+def fetch_latest_water_level_data(use_cache=True, max_age=LEVEL_DATA_MAX_AGE, stale_while_revalidate=False,
+                                  stream=False):
+    """Fetch latest levels from all 'measures'. Returns JSON object.
+
+    Cached data older than max_age is revalidated with the service, and
+    a generator of the measure items can be returned by setting stream
+    to True (see fetch_station_data).
 
-def fetch_latest_water_level_data(use_cache=False):
-    """Fetch latest levels from all 'measures'. Returns JSON object"""
+    """
 
     # URL for retrieving data
     url = "http://environment.data.gov.uk/flood-monitoring/id/measures?parameter=level&qualifier=Stage&qualifier=level"  # noqa
@@ -93,24 +582,188 @@ def fetch_latest_water_level_data(use_cache=False):
 
     # Attempt to load level data from file, otherwise fetch over
     # Internet
-    if use_cache:
-        try:
-            # Attempt to load from file
-            data = load(cache_file)
-        except FileNotFoundError:
-            data = fetch(url)
-            dump(data, cache_file)
+    return _fetch_cached(url, cache_file, use_cache, max_age, stale_while_revalidate, stream)
+
+
+# Cache of readings for measures (created on first use, see
+# get_readings_cache), and the options it is created with (see
+# configure_readings_cache)
+_readings_cache = None
+_readings_cache_lock = threading.Lock()
+_readings_cache_options = {'max_measures': MAX_MEASURES, 'max_readings': MAX_READINGS}
+
+
+def configure_readings_cache(max_measures=MAX_MEASURES, max_readings=MAX_READINGS):
+    """Configure the cache of readings used by fetch_measure_levels: the
+    least recently used measures are evicted when it holds more than
+    max_measures measures or max_readings readings (see ReadingsCache).
+    The current cache is flushed, and the cache is opened again with the
+    new limits on next use.
+
+    """
+
+    global _readings_cache
+    with _readings_cache_lock:
+        if _readings_cache is not None:
+            _readings_cache.flush()
+        _readings_cache = None
+        _readings_cache_options.update(max_measures=max_measures, max_readings=max_readings)
+
+
+def get_readings_cache():
+    """Return the cache of readings used by fetch_measure_levels,
+    creating it if required"""
+
+    global _readings_cache
+    with _readings_cache_lock:
+        if _readings_cache is None:
+            _readings_cache = ReadingsCache(os.path.join('cache', 'readings'), **_readings_cache_options)
+        return _readings_cache
+
+
+def _reading_time(item):
+    """Return the time of a reading (item) as a naive UTC datetime"""
+    d = dateutil.parser.isoparse(item['dateTime'])
+    if d.tzinfo is not None:
+        d = d.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return d
+
+
+def _readings_url(measure_id, start):
+    """Return URL for fetching readings for a measure since start"""
+    return measure_id + "/readings/?_sorted&since=" + start.isoformat() + 'Z'
+
+
+# Long windows of readings are fetched in chunks of this length (see
+# fetch_measure_levels), with up to READINGS_LIMIT readings per request
+READINGS_CHUNK = datetime.timedelta(days=7)
+READINGS_LIMIT = 10000
+
+
+def _sort_readings(items, start):
+    """Return readings (items) since start, with duplicate readings
+    removed, sorted with the latest first (as returned by the service)"""
+
+    # Remove duplicates, with later readings replacing earlier readings
+    # for the same time
+    items = {item['dateTime']: item for item in items}.values()
+
+    times = [(_reading_time(item), item) for item in items]
+    times = [(t, item) for t, item in times if t >= start]
+    times.sort(key=lambda x: x[0], reverse=True)
+    return [item for t, item in times]
+
+
+def _fetch_readings_pages(url):
+    """Return readings (items) from url, fetching pages of up to
+    READINGS_LIMIT readings until all readings are fetched"""
+
+    items = []
+    offset = 0
+    while True:
+        page = fetch(url + "&_limit={}&_offset={}".format(READINGS_LIMIT, offset))['items']
+        items.extend(page)
+        if len(page) < READINGS_LIMIT:
+            return items
+        offset += len(page)
+
+
+def _fetch_readings_range(measure_id, first_day, last_day):
+    """Return readings (items) for a measure from the start of first_day
+    to the end of last_day (dates)"""
+    return _fetch_readings_pages(measure_id + "/readings/?_sorted&startdate={}&enddate={}".format(
+        first_day.isoformat(), last_day.isoformat()))
+
+
+def _fetch_readings(measure_id, start, end, chunk, chunk_workers):
+    """Return readings (items) for a measure since start, sorted with the
+    latest first. If the window from start to end is longer than chunk,
+    it is split into chunks (of whole days) which are fetched
+    concurrently using up to chunk_workers threads."""
+
+    if chunk is None or end - start <= chunk:
+        return _fetch_readings_pages(_readings_url(measure_id, start))
+
+    # Split window into ranges of days
+    days = max(chunk.days, 1)
+    ranges = []
+    first_day = start.date()
+    while first_day <= end.date():
+        last_day = min(first_day + datetime.timedelta(days=days - 1), end.date())
+        ranges.append((first_day, last_day))
+        first_day = last_day + datetime.timedelta(days=1)
+
+    # Fetch ranges concurrently and stitch together
+    with ThreadPoolExecutor(max_workers=min(chunk_workers, len(ranges))) as executor:
+        pages = executor.map(lambda r: _fetch_readings_range(measure_id, *r), ranges)
+        items = [item for page in pages for item in page]
+
+    return _sort_readings(items, start)
+
+
+def _fetch_readings_cached(measure_id, start, end, chunk, chunk_workers):
+    """Return readings (items) for a measure since start, using the
+    readings cache so that only readings newer than the latest cached
+    reading are fetched"""
+
+    cache = get_readings_cache()
+    entry = cache.get(measure_id)
+
+    if entry is not None and entry[1] and dateutil.parser.isoparse(entry[0]) <= start:
+        # Cached readings cover the start of the window, so only fetch
+        # readings from the latest cached reading onwards (new readings
+        # replace cached readings for the same time)
+        cached_items = entry[1]
+        latest = max(_reading_time(item) for item in cached_items)
+        new_items = _fetch_readings_pages(_readings_url(measure_id, latest))
+        items = cached_items + new_items
     else:
-        data = fetch(url)
-        dump(data, cache_file)
+        items = _fetch_readings(measure_id, start, end, chunk, chunk_workers)
 
-    return data
+    # Trim readings to the window and sort
+    items = _sort_readings(items, start)
+
+    cache.put(measure_id, start.isoformat(), items)
 
+    return items
 
-def fetch_measure_levels(measure_id, dt):
+
+def _parse_reading_arrays(items):
+    """Return arrays of the times (as Matplotlib date numbers) and
+    values (NaN if missing) of readings (items) (see parse_readings)"""
+
+    # Parse ISO 8601 date-time strings with NumPy (dropping the UTC
+    # 'Z' suffix), falling back to dateutil for other formats
+    try:
+        times = np.array([item['dateTime'].rstrip('Z') for item in items], dtype='datetime64[us]')
+        times = date.date2num(times)
+    except ValueError:
+        times = date.date2num([dateutil.parser.parse(item['dateTime']) for item in items])
+
+    values = np.array([item['value'] if isinstance(item.get('value'), (int, float)) else np.nan
+                       for item in items], dtype=np.float64)
+
+    return np.asarray(times, dtype=np.float64), values
+
+
+def fetch_measure_levels(measure_id, dt, use_cache=False, archive=None, as_array=False, chunk=READINGS_CHUNK,
+                         chunk_workers=4):
     """Fetch measure levels from latest reading and going back a period
     dt. Return list of dates and a list of values.
 
+    If use_cache is True, readings are stored in the readings cache
+    and only readings newer than those already cached are fetched. If
+    a ReadingsArchive object (archive) is given, the readings are also
+    appended to the archive.
+
+    If as_array is True, return a NumPy array of dates (as Matplotlib
+    date numbers, i.e. days) and a NumPy array of values (NaN if
+    missing) instead.
+
+    Periods longer than chunk (None to never split) are fetched as
+    chunks of whole days, using up to chunk_workers threads, which are
+    stitched together in order.
+
     """
 
     # Current time (UTC)
@@ -119,17 +772,33 @@ def fetch_measure_levels(measure_id, dt):
     # Start time for data
     start = now - dt
 
-    # Construct URL for fetching data
-    url_base = measure_id
-    url_options = "/readings/?_sorted&since=" + start.isoformat() + 'Z'
-    url = url_base + url_options
-
     # Fetch data
-    data = fetch(url)
+    if use_cache:
+        items = _fetch_readings_cached(measure_id, start, now, chunk, chunk_workers)
+    else:
+        items = _fetch_readings(measure_id, start, now, chunk, chunk_workers)
+
+    dates, levels = parse_readings(items, as_array)
+
+    # Add readings to archive
+    if archive is not None:
+        archive.append(measure_id, dates, levels)
+
+    return dates, levels
+
+
+def parse_readings(items, as_array=False):
+    """For a list of readings (items) fetched from the Environment agency,
+    return a list of dates and a list of values (None if missing). If
+    as_array is True, return NumPy arrays instead (see
+    fetch_measure_levels)."""
+
+    if as_array:
+        return _parse_reading_arrays(items)
 
     # Extract dates and levels
     dates, levels = [], []
-    for measure in data['items']:
+    for measure in items:
         # Convert date-time string to a datetime object
         d = dateutil.parser.parse(measure['dateTime'])
 
@@ -142,3 +811,51 @@ def fetch_measure_levels(measure_id, dt):
             levels.append(None)
 
     return dates, levels
+
+
+def fetch_readings_since(since):
+    """Fetch all level readings, for all measures, since a time (since).
+    Readings are fetched in pages of up to READINGS_LIMIT readings.
+    Return list of readings (JSON objects with 'measure', 'dateTime' and
+    'value'), with the latest first."""
+
+    # URL for retrieving readings from all measures
+    url = "http://environment.data.gov.uk/flood-monitoring/data/readings?parameter=level&_sorted&since="  # noqa
+
+    return _fetch_readings_pages(url + since.isoformat() + 'Z')
+
+
+def fetch_measure_levels_many(measure_ids, dt, max_workers=8, chunk_workers=4, **kwargs):
+    """Fetch measure levels for a collection of measures, going back a
+    period dt from the latest reading. The requests are made
+    concurrently using a bounded pool of max_workers threads. Return a
+    dictionary mapping each measure id to its (dates, levels) tuple, as
+    returned by fetch_measure_levels (other keyword arguments are passed
+    to fetch_measure_levels).
+
+    Each measure's readings may be fetched in chunks using up to
+    chunk_workers threads (see fetch_measure_levels). The numbers of
+    threads are reduced if required so that the total number of
+    concurrent requests is no more than the session's connection pool
+    size (see configure_session).
+
+    """
+
+    # Remove duplicate measure ids (preserving order) so that each
+    # measure is only fetched once
+    measure_ids = list(dict.fromkeys(measure_ids))
+    if not measure_ids:
+        return {}
+
+    # Limit the number of concurrent requests to the connection pool size,
+    # so that requests do not wait for (or open extra) connections
+    pool_size = _session_options['pool_size']
+    max_workers = max(1, min(max_workers, len(measure_ids), pool_size))
+    kwargs['chunk_workers'] = max(1, min(chunk_workers, pool_size // max_workers))
+
+    # Fetch data for all measures using a pool of worker threads (writing
+    # the index of the readings cache once at the end, if it is used)
+    batch = get_readings_cache().batch() if kwargs.get('use_cache') else contextlib.nullcontext()
+    with batch, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda measure_id: fetch_measure_levels(measure_id, dt, **kwargs), measure_ids)
+        return dict(zip(measure_ids, results))
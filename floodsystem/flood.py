@@ -1,11 +1,39 @@
 """This module provides tools for assessing flood risk
 """
 
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
-from floodsystem.datafetcher import fetch_measure_levels
+from floodsystem.datafetcher import fetch_measure_levels, fetch_measure_levels_many
 import numpy as np
-from floodsystem.analysis import polyfit
-from matplotlib import dates as date
+from floodsystem.analysis import date_nums, level_array, mean_gradients, get_trend_estimator
+from floodsystem.stationtable import StationTable
+from floodsystem.trend import get_trend_store
+
+def relative_water_levels(stations):
+    """For a list of MonitoringStation objects or a StationTable (stations), returns a NumPy array of
+    the relative water level of each station (see MonitoringStation.relative_water_level), computed for
+    all stations at once. The value is NaN for stations where it is not available."""
+
+    if isinstance(stations, StationTable):
+        # Use table columns (and cached consistency mask) directly
+        low, high, level = stations.typical_low, stations.typical_high, stations.latest_level
+        consistent = stations.typical_range_consistent_mask()
+    else:
+        # Build arrays of typical ranges and latest levels (NaN if not available)
+        ranges = np.array([station.typical_range or (None, None) for station in stations], dtype=float)
+        ranges = ranges.reshape(-1, 2)
+        low, high = ranges[:, 0], ranges[:, 1]
+        level = np.array([station.latest_level for station in stations], dtype=float)
+        consistent = ~np.isnan(low) & ~np.isnan(high)
+        consistent[consistent] = high[consistent] >= low[consistent]
+
+    # Shift and scale latest levels (NaN if range inconsistent or the range is zero)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative_level = (level - low) / (high - low)
+    relative_level[~consistent | ~np.isfinite(relative_level)] = np.nan
+
+    return relative_level
 
 def stations_level_over_threshold(stations, tol):
     """For a list of MonitoringStation objects (stations) and a tolerance value (tol),
@@ -14,67 +42,93 @@ def stations_level_over_threshold(stations, tol):
 
     Note: "update_water_levels" function needs to be called at least once for this function to work."""
 
-    # Create the output list
-    output = []
-
-    for station in stations:
-        # Get the relative water level. Will be "None" if typical range is inconsistent or the latest level
-        # is not known
-        relative_level = station.relative_water_level()
+    if not isinstance(stations, StationTable):
+        stations = list(stations)
 
-        # Check if the relative level is "None" and, if not "None", compare it with the tolerance value
-        if relative_level is not None and relative_level > tol:
-            # Append tuple of MonitoringStation object and relative level to the output list
-            output.append((station, relative_level))
+    # Get the relative water levels. Will be NaN if typical range is inconsistent or the latest level
+    # is not known (comparisons with NaN are False)
+    relative_levels = relative_water_levels(stations)
+    over_threshold = np.flatnonzero(relative_levels > tol)
 
-    # Sort the list in order of descending relative water levels
-    output.sort(key=lambda val: val[1], reverse=True)
+    # Sort in order of descending relative water levels
+    over_threshold = over_threshold[np.argsort(-relative_levels[over_threshold], kind='stable')]
 
-    # Return the output list
-    return output
+    # Return list of tuples of MonitoringStation object and relative level
+    return [(stations[i], float(relative_levels[i])) for i in over_threshold]
 
 def stations_highest_rel_level(stations, N):
     """For a list of MonitoringStaton objects (stations), returns a list of the N stations
     at which the water level, relative to the typical range, is highest"""
 
-    #Filter list as to not include stations without relative water level
-    new_stations = list(filter(lambda station: station.relative_water_level() is not None, stations))
+    if not isinstance(stations, StationTable):
+        stations = list(stations)
+    if N <= 0:
+        return []
+
+    #Get relative water levels, and indices of stations which have a relative water level
+    relative_levels = relative_water_levels(stations)
+    available = np.flatnonzero(~np.isnan(relative_levels))
 
-    #Sorts stations in descending order of relative water level
-    new_stations.sort(key=lambda station: station.relative_water_level(), reverse = True)
+    #Find N stations with highest relative water level in O(n) using a partial sort
+    if N < len(available):
+        available = available[np.argpartition(-relative_levels[available], N - 1)[:N]]
 
-    #Return first N stations in lists (N stations with highest water level)
-    return new_stations[:N]
+    #Sort the N stations in descending order of relative water level
+    highest = available[np.argsort(-relative_levels[available], kind='stable')]
+    return [stations[i] for i in highest]
 
-def get_station_flood_risk(station):
+def get_station_flood_risk(station, history=None, estimator='polyfit', cache=None):
     """For a MonitoringStation object (station), returns flood a risk rating - a number between 
-    0 and 4. Uses data for the relative water level and the rise in the """
+    0 and 4. Uses data for the relative water level and the rise in the water level. A (dates, levels)
+    tuple for the last 2 days (history) can be given to avoid fetching it again. The rise in the water
+    level is found using a trend estimator (estimator), which is the name of one of
+    analysis.TREND_ESTIMATORS or a function (see get_level_rise). If a RiskCache (cache) is given, the
+    cached rating is returned if the station has no new readings since it was calculated."""
 
-    flood_risk = 0
+    #Use cached rating if still valid
+    if cache is not None:
+        found, flood_risk = cache.lookup(station, estimator)
+        if found:
+            return flood_risk
 
-    rel_level_threshold = 2
-    rise_threshold = 0.1
-    
-    #First factor is the current relative water level of station - sets initial risk 
+    #First factor is the current relative water level of station - sets initial risk
     rel_water_level = station.relative_water_level()
 
     #If no data available for relative water level, cannot calculate score, so return None
     if rel_water_level is None:
+        flood_risk = None
+    else:
+        #Second factor is the rate of change of the water level (e.g., if rising rapidly, give a high score)
+        #- used to adjust risk
+        level_rise = get_level_rise(station, history, estimator)
+        flood_risk = _flood_risk(rel_water_level, level_rise)
+
+    if cache is not None:
+        cache.put(station, flood_risk, estimator)
+    return flood_risk
+
+def _flood_risk(rel_water_level, level_rise):
+    """Returns flood risk rating for a relative water level and rate of water level rise (None if
+    either is not available)"""
+
+    rel_level_threshold = 2
+    rise_threshold = 0.1
+
+    #Rates of rise smaller than this (levels per day) are treated as zero, as fits to constant levels
+    #give tiny non-zero slopes from rounding errors
+    rise_tolerance = 1e-9
+
+    #If no data available, cannot calculate score, so return None
+    if rel_water_level is None or level_rise is None:
         return None
+
     if rel_water_level > rel_level_threshold:
         flood_risk = 3 #If above threshold, set high risk
     else:
         flood_risk = 1 #If below threshold, set low risk
 
-    #Second factor is the rate of change of the water level (e.g., if rising rapidly, give a high score) - used to adjust risk
-    level_rise = get_level_rise(station)
-
-    #If no data available for level rise, cannot calculate score, so return None
-    if level_rise is None:
-        return None
-
     #For decreasing level, reduce flood risk
-    if level_rise < 0:
+    if level_rise < -rise_tolerance:
         flood_risk -= 1
     #For increasing level above threshold, increase flood risk
     if level_rise > rise_threshold:
@@ -82,51 +136,171 @@ def get_station_flood_risk(station):
 
     return flood_risk
 
-def get_level_rise(station):
+def get_level_rise(station, history=None, estimator='polyfit'):
     """For a MonitoringStation object (station), returns a the rate of water level rise, specifically
-    the average value over the last 2 days"""
-    #Fetch data (if no data available, return None)
-    times, values = fetch_measure_levels(station.measure_id, timedelta(days=2))
-    
-    #Only continue if data available, otherwise return None
-    if times and values and     (None in times or None in values) == False:
-        #Get polynomial approximation of
-        poly, d0 = polyfit(times, values, p=4)
-
-        #Find derivative polynomial
-        level_der = np.polyder(poly)
-        
-        #Obtain list of gradients over last 2 days using the derivative polynomial
-        grads = []
-        for t in times:
-            grads.append(level_der(date.date2num(t) - d0))
-
-        #Return average of gradient values
-        return np.average(grads)
-    else:
+    the average value over the last 2 days. A (dates, levels) tuple for the last 2 days (history) can be
+    given, otherwise it is fetched. The rate is found using a trend estimator (estimator): the name of
+    one of analysis.TREND_ESTIMATORS ('polyfit' averages the derivative of a degree 4 polynomial fit,
+    'linear', 'theil_sen' and 'ew' are cheaper estimates of the slope), or a function of arrays of date
+    numbers and levels returning the slope in levels per day. If estimator is 'online', the slope of the
+    station's trend kept up to date by update_water_levels (see trend.get_trend_store) is returned
+    instead, without using any level history."""
+    #Use running trend, without fetching data
+    if estimator == 'online':
+        return get_trend_store().slope(station.measure_id)
+
+    #Fetch data if not given (if no data available, return None)
+    if history is None:
+        history = fetch_measure_levels(station.measure_id, timedelta(days=2), as_array=True)
+    return _level_rise(history, estimator)
+
+def _level_rise(history, estimator='polyfit'):
+    """Returns the average rate of water level rise for a (dates, levels) tuple (history), or None if
+    not available (see get_level_rise). This is a module level function so that it can be run in a
+    process pool."""
+    estimator = get_trend_estimator(estimator)
+    times, values = history
+
+    #Convert data to arrays (missing values are NaN)
+    times = date_nums(times)
+    values = level_array(values)
+    if len(times) != len(values):
         return None
 
-def get_town_flood_risk(town, stations_by_town):
+    #Only use readings with levels, and return None if there are too few to find a rate
+    valid = ~np.isnan(values)
+    if np.count_nonzero(valid) < 2:
+        return None
+    return estimator(times[valid], values[valid])
+
+def get_town_flood_risk(town, stations_by_town, max_workers=8, histories=None, cache=None):
     """Obtains the flood risk for a town, based on the flood risks for the towns
     respective station, using the same rating system - returned value is the highest
-    flood risk of the towns stations"""
+    flood risk of the towns stations. The level data for the town's stations is fetched
+    concurrently using up to max_workers threads, unless a dictionary mapping measure ids
+    to level data for the last 2 days (histories) is given, e.g. from
+    update_water_level_histories. If a RiskCache (cache) is given, stations with valid
+    cached ratings are not scored (or fetched) again."""
     
     #Get stations for town
     stations_in_town = stations_by_town[town]
 
-    flood_risk = get_station_flood_risk(stations_in_town[0])
-    
+    #Find cached ratings
+    cached = {}
+    if cache is not None:
+        for station in stations_in_town:
+            found, flood_risk = cache.lookup(station)
+            if found:
+                cached[station.measure_id] = flood_risk
+
+    #Fetch level data for the last 2 days for all of the town's other stations at once
+    if histories is None:
+        histories = fetch_measure_levels_many([station.measure_id for station in stations_in_town
+                                               if station.measure_id not in cached],
+                                              timedelta(days=2), max_workers, as_array=True)
+
+    flood_risks = []
+    for station in stations_in_town:
+        if station.measure_id in cached:
+            flood_risks.append(cached[station.measure_id])
+        else:
+            flood_risks.append(get_station_flood_risk(station, histories[station.measure_id]))
+            if cache is not None:
+                cache.put(station, flood_risks[-1])
+    return _town_flood_risk(flood_risks)
+
+def _town_flood_risk(flood_risks):
+    """Returns the flood risk for a town from the flood risks of its stations (in order)"""
+
+    flood_risk = flood_risks[0]
+
     #Find highest flood risk value from town's stations by iterating through stations
-    for i in range(1, len(stations_in_town)):
-        new_flood_risk = get_station_flood_risk(stations_in_town[i])
+    for new_flood_risk in flood_risks[1:]:
         if new_flood_risk is None:
             break
         if flood_risk is None or new_flood_risk > flood_risk:
             flood_risk = new_flood_risk
-    
+
     #Return highest value
     return flood_risk
 
+def score_all_towns(stations_by_town, workers=8, fit_workers=0, histories=None, cache=None):
+    """For a dictionary mapping town names to lists of MonitoringStation objects (stations_by_town),
+    returns a tuple of a dictionary mapping each town to its flood risk (as for get_town_flood_risk),
+    and a dictionary of the time (in seconds) taken by each stage: 'dedupe', 'fetch', 'fit' and
+    'score'.
+
+    Each station is only scored once, even if it is in several towns. Level data for the last 2 days is
+    fetched concurrently using up to workers threads (unless a dictionary mapping measure ids to level
+    data, histories, is given). The level rises of all stations are calculated together using batched
+    polynomial fits (see analysis.mean_gradients), in this process or split between a pool of fit_workers
+    processes. As for get_level_rise, the level rise is the average gradient of the fit at the reading
+    times. If a RiskCache (cache) is given, stations with valid cached ratings are not fetched or fitted
+    again."""
+
+    timings = {}
+
+    #Find each station once (by station id, or by object if there is no id), and its relative level
+    start = time.perf_counter()
+    stations = {}
+    for town_stations in stations_by_town.values():
+        for station in town_stations:
+            key = station.station_id if station.station_id is not None else station
+            if key not in stations:
+                stations[key] = station
+    rel_levels = {key: station.relative_water_level() for key, station in stations.items()}
+
+    #Find cached ratings (the level rises are the same as for get_station_flood_risk with the 'polyfit'
+    #estimator, so ratings are shared with get_station_flood_risk and get_town_flood_risk)
+    cached = {}
+    if cache is not None:
+        for key, station in stations.items():
+            found, flood_risk = cache.lookup(station, 'polyfit')
+            if found:
+                cached[key] = flood_risk
+
+    #Stations without a relative level cannot be scored, so do not need level data
+    scored = [key for key in stations if rel_levels[key] is not None and key not in cached]
+    timings['dedupe'] = time.perf_counter() - start
+
+    #Fetch level data for all stations at once
+    start = time.perf_counter()
+    if histories is None:
+        histories = fetch_measure_levels_many([stations[key].measure_id for key in scored], timedelta(days=2),
+                                              workers, as_array=True)
+    timings['fetch'] = time.perf_counter() - start
+
+    #Calculate level rises for all stations at once using batched polynomial fits, optionally split
+    #between a pool of processes
+    start = time.perf_counter()
+    station_histories = [histories[stations[key].measure_id] for key in scored]
+    if not fit_workers or len(station_histories) < 2:
+        gradients = mean_gradients(station_histories, p=4)
+    else:
+        size = -(-len(station_histories) // fit_workers)
+        blocks = [station_histories[i:i + size] for i in range(0, len(station_histories), size)]
+        with ProcessPoolExecutor(max_workers=fit_workers) as executor:
+            gradients = np.concatenate(list(executor.map(mean_gradients, blocks)))
+    level_rises = [None if np.isnan(gradient) else float(gradient) for gradient in gradients]
+    level_rises = dict(zip(scored, level_rises))
+    timings['fit'] = time.perf_counter() - start
+
+    #Score stations, and then towns
+    start = time.perf_counter()
+    flood_risks = {key: cached[key] if key in cached else _flood_risk(rel_levels[key], level_rises.get(key))
+                   for key in stations}
+    if cache is not None:
+        for key, station in stations.items():
+            if key not in cached:
+                cache.put(station, flood_risks[key], 'polyfit')
+    town_risks = {}
+    for town, town_stations in stations_by_town.items():
+        keys = [station.station_id if station.station_id is not None else station for station in town_stations]
+        town_risks[town] = _town_flood_risk([flood_risks[key] for key in keys]) if keys else None
+    timings['score'] = time.perf_counter() - start
+
+    return town_risks, timings
+
 def get_flood_risk_rating(num):
     """Converts an integer value of a flood risk rating to the rating it 
     represents - low (0/1), moderate (2), high (3), severe (4)"""
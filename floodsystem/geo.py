@@ -6,54 +6,144 @@ geographical data.
 
 """
 
+import heapq
+import math
+
+import numpy as np
 from tkinter.font import names
 from .utils import sorted_by_key  # noqa
-from haversine import haversine as hav  # haversine function for distance
+
+# Mean radius of the Earth (km), as used by the haversine function
+EARTH_RADIUS = 6371.0088
+
+# Station attributes that stations are grouped by in group_stations
+GROUP_COLUMNS = ('river', 'town', 'catchment')
+
+
+def station_coords(stations):
+    """For a list of MonitoringStation objects (stations), returns an (n, 2) array of station
+    coordinates (latitude, longitude) in degrees"""
+
+    # Use the coordinate columns of a StationTable directly
+    if hasattr(stations, 'lat') and hasattr(stations, 'lon'):
+        return np.column_stack((stations.lat, stations.lon))
+    return np.array([station.coord for station in stations], dtype=float).reshape(-1, 2)
+
+
+def haversine_distances(coords, p):
+    """For an (n, 2) array of coordinates (latitude, longitude) in degrees and a coordinate tuple (p),
+    returns an array of the n great-circle distances (in km) from p, calculated with the haversine
+    formula (as for the haversine function, but for all coordinates at once)"""
+
+    coords = np.radians(np.asarray(coords, dtype=float).reshape(-1, 2))
+    lat, lon = coords[:, 0], coords[:, 1]
+    lat_p, lon_p = np.radians(p[0]), np.radians(p[1])
+
+    d = np.sin((lat - lat_p) * 0.5) ** 2 + np.cos(lat) * np.cos(lat_p) * np.sin((lon - lon_p) * 0.5) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(d, 1)))
+
+
+def haversine_distance_matrix(coords1, coords2, block_size=1024):
+    """For (n, 2) and (m, 2) arrays of coordinates (latitude, longitude) in degrees, returns an (n, m)
+    array of the great-circle distances (in km) between each pair of coordinates. The distances are
+    calculated in blocks of block_size rows, to limit the size of temporary arrays."""
+
+    coords1 = np.radians(np.asarray(coords1, dtype=float).reshape(-1, 2))
+    coords2 = np.radians(np.asarray(coords2, dtype=float).reshape(-1, 2))
+    lat2, lon2 = coords2[:, 0], coords2[:, 1]
+    cos_lat2 = np.cos(lat2)
+
+    distances = np.empty((len(coords1), len(coords2)))
+    for i in range(0, len(coords1), block_size):
+        lat1 = coords1[i:i + block_size, 0, np.newaxis]
+        lon1 = coords1[i:i + block_size, 1, np.newaxis]
+        d = np.sin((lat2 - lat1) * 0.5) ** 2 + np.cos(lat1) * cos_lat2 * np.sin((lon2 - lon1) * 0.5) ** 2
+        distances[i:i + block_size] = 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(d, 1)))
+
+    return distances
 
 
 def stations_by_distance(stations, p):
     """For a list of MonitoringStation objects (stations) and a coordinate tuple (p),
     returns a list of station and distance tuples sorted by distance."""
 
-    # First a list of (station, distance) tuples is made
-    # The list is then sorted by the "sort_by_key" function
-    # Uses haversine function to calculate distance
-    return sorted_by_key([(station, hav(station.coord, p)) for station in stations], 1)
+    # Distances to all stations are calculated at once, then the
+    # (station, distance) tuples are made in order of distance
+    stations = stations if hasattr(stations, '__getitem__') else list(stations)
+    distances = haversine_distances(station_coords(stations), p)
+    order = np.argsort(distances, kind='stable')
+    return [(stations[i], float(distances[i])) for i in order]
 
 
 def stations_within_radius(stations, centre, r):
     """For a list of MonitoringStation objects (stations) and a coordinate tuple (centre),
     returns a list of all the stations within in a radius r (in km) of the centre coordinate."""
 
-    # List to compile stations within radius
-    stations_within_radius = []
+    # Distances to all stations are calculated at once, then the stations
+    # within the radius are selected
+    stations = stations if hasattr(stations, '__getitem__') else list(stations)
+    within = haversine_distances(station_coords(stations), centre) < r
+    return [stations[i] for i in np.flatnonzero(within)]
 
-    for station in stations:
-        # If station within radius, add to list
-        # Distance calculated using haversine function
-        if hav(station.coord, centre) < r:
-            stations_within_radius.append(station)
-    return stations_within_radius
 
+def group_stations(stations):
+    """For a list of MonitoringStation objects (stations), returns a dictionary that maps 'river', 'town'
+    and 'catchment' to dictionaries that map names (key) to a list of MonitoringStation objects with that
+    name. The stations are grouped in a single pass, and each station (identified by its station id, or by
+    the object if it has no id) is only included once. For a StationTable, the groups are cached until
+    the table changes."""
 
-def stations_by_river(stations):
-    """For a list of MonitoringStation objects (stations),
-    returns a dictionary that maps river names (key) to a list of MonitoringStation objects on a given river."""
+    return _station_groups(stations)
+
+
+def _station_groups(stations, columns=GROUP_COLUMNS):
+    """Returns groups of stations for group_stations (only for the given columns). For a StationTable,
+    the cached groups are copied, so that they cannot be modified; groups built for a list of stations
+    are not shared, so they are returned without copying."""
 
-    # Dictionary containing river names and their corresponding stations
-    rivers = {}
+    if hasattr(stations, 'cached'):
+        groups = stations.cached('groups', _group_stations)
+        return {column: _copy_groups(groups[column]) for column in columns}
+    return _group_stations(stations, columns)
 
+
+def _copy_groups(index):
+    """Copy lists of stations, so that cached groups cannot be modified"""
+    return {name: list(group) for name, group in index.items()}
+
+
+def _unique_stations(stations):
+    """Generator of stations, skipping duplicate stations (with the same station id, or the same object if
+    the station has no id)"""
+
+    seen = set()
     for station in stations:
-        # Check if river is already in the dictionary
-        if station.river in rivers:
-            # Check if the station has already been added to the list
-            if station not in rivers[station.river]:
-                rivers[station.river].append(station)
+        key = station.station_id if station.station_id is not None else station
+        if key not in seen:
+            seen.add(key)
+            yield station
 
-        else:
-            rivers.update({station.river: [station]})
 
-    return rivers
+def _group_stations(stations, columns=GROUP_COLUMNS):
+    """Groups stations in a single pass (see group_stations)"""
+
+    groups = {column: {} for column in columns}
+    for station in _unique_stations(stations):
+        for column, index in groups.items():
+            name = getattr(station, column)
+            if name in index:
+                index[name].append(station)
+            else:
+                index[name] = [station]
+
+    return groups
+
+
+def stations_by_river(stations):
+    """For a list of MonitoringStation objects (stations),
+    returns a dictionary that maps river names (key) to a list of MonitoringStation objects on a given river."""
+
+    return _station_groups(stations, ('river',))['river']
 
 
 def rivers_with_station(stations):
@@ -69,49 +159,158 @@ def rivers_with_station(stations):
 
     return rivers
 
+def river_station_counts(stations):
+    """For a list of MonitoringStation objects (stations), returns a dictionary that maps river names
+    (key) to the number of stations on the river (counting each station once, as for group_stations).
+    For a StationTable, the cached river groups are used."""
+
+    if hasattr(stations, 'cached'):
+        return {river: len(group) for river, group in stations.cached('groups', _group_stations)['river'].items()}
+
+    counts = {}
+    for station in _unique_stations(stations):
+        counts[station.river] = counts.get(station.river, 0) + 1
+
+    return counts
+
+
 def rivers_by_station_number(stations, N):
-    """For a list of MonitoringStation objects (stations), returns a list of 
-    tuples (river name, number of stations) of the names of the N rivers with 
+    """For a list of MonitoringStation objects (stations), returns a list of
+    tuples (river name, number of stations) of the names of the N rivers with
     the greatest number of stations, sorted by their number of stations.
-    Note that, if there are more rivers with the same number of stations as the 
+    Note that, if there are more rivers with the same number of stations as the
     Nth entry, these rivers will be included in the list."""
 
-    # Obtain dictionary of rivers with list of monitoring stations for each river
-    rivers = stations_by_river(stations)
+    # Obtain dictionary of rivers with number of monitoring stations for each river
+    counts = river_station_counts(stations)
+    if N <= 0 or not counts:
+        return []
 
-    # Sort rivers by number of stations (in descending order)
-    sorted_rivers = sorted(rivers.items(), key=lambda k: len(k[1]), reverse = True)
+    # Find number of stations of the Nth river using a heap, without sorting every river
+    threshold = heapq.nlargest(N, counts.values())[-1]
 
-    # List of tuples to return
-    rivers_and_station_num = []
+    # Select rivers with at least this number of stations (including rivers with the same number as
+    # the Nth entry), and sort them by number of stations (in descending order)
+    rivers_and_station_num = [(river, n) for river, n in counts.items() if n >= threshold]
+    rivers_and_station_num.sort(key=lambda k: k[1], reverse=True)
 
-    i = 0
-    #Add tuples to list for first N items and from then on if number of stations equal to that of the Nth entry
-    #'i != 0 term' means it is not checked on first iteration which would throw error as no item previous to 0th index
-    while i < N or (i != 0 and len(sorted_rivers[i-1][1]) == len(sorted_rivers[i][1])):
-        rivers_and_station_num.append((sorted_rivers[i][0], len(sorted_rivers[i][1])))
-        i += 1
-    
     return rivers_and_station_num
 
+
 def stations_by_town(stations):
     """For a list of MonitoringStation objects (stations),
     returns a dictionary that maps town names (key) to a list of MonitoringStation objects on a given town."""
 
-    # Dictionary containing town names and their corresponding stations
-    towns = {}
+    return _station_groups(stations, ('town',))['town']
 
-    for station in stations:
-        # Check if town is already in the dictionary
-        if station.town in towns:
-            # Check if the station has already been added to the list
-            if station not in towns[station.town]:
-                towns[station.town].append(station)
 
+class SpatialIndex:
+    """This class represents a spatial index of a list of MonitoringStation objects (stations), for
+    answering many radius, nearest and bounding box queries without checking every station. Stations
+    are put into a grid of latitude/longitude cells (of size cell_size degrees); a query only checks the
+    stations in the cells that it overlaps, and then calculates exact distances for these stations.
+
+    Building the index takes O(n) time, so it is only worth it for many queries on the same stations, and
+    it must be built again if the stations change. Fixed cells suit stations spread fairly evenly (as in
+    England); queries with a large radius, or near a pole, check most stations and are no faster than
+    stations_within_radius. nearest searches with a radius that doubles until k stations are found, so
+    can take several queries for a point far from any station."""
+
+    def __init__(self, stations, cell_size=0.25):
+
+        self.stations = stations if hasattr(stations, '__getitem__') else list(stations)
+        self.cell_size = cell_size
+
+        self.coords = station_coords(self.stations)
+        self.lat, self.lon = self.coords[:, 0], self.coords[:, 1]
+
+        # Map from (latitude cell, longitude cell) to array of station indices
+        rows = np.floor(self.lat / cell_size).astype(int)
+        cols = np.floor(self.lon / cell_size).astype(int)
+        cells = {}
+        for i, cell in enumerate(zip(rows.tolist(), cols.tolist())):
+            cells.setdefault(cell, []).append(i)
+        self._cells = {cell: np.array(indices) for cell, indices in cells.items()}
+
+    def _indices_in_box(self, lat_min, lat_max, lon_min, lon_max):
+        """Returns array of indices of stations in the cells overlapping a box (longitudes may extend
+        past +/-180 degrees, in which case the box wraps around)"""
+
+        # Split box into longitude ranges within [-180, 180]
+        if lon_max - lon_min >= 360:
+            lon_ranges = [(-180, 180)]
+        elif lon_min < -180:
+            lon_ranges = [(lon_min + 360, 180), (-180, lon_max)]
+        elif lon_max > 180:
+            lon_ranges = [(lon_min, 180), (-180, lon_max - 360)]
+        else:
+            lon_ranges = [(lon_min, lon_max)]
+
+        row_min, row_max = math.floor(lat_min / self.cell_size), math.floor(lat_max / self.cell_size)
+        col_ranges = [(math.floor(a / self.cell_size), math.floor(b / self.cell_size)) for a, b in lon_ranges]
+
+        # Check each cell in box, or each occupied cell if there are fewer of them
+        num_cells = (row_max - row_min + 1) * sum(b - a + 1 for a, b in col_ranges)
+        if num_cells > len(self._cells):
+            cells = [cell for cell in self._cells if row_min <= cell[0] <= row_max
+                     and any(a <= cell[1] <= b for a, b in col_ranges)]
         else:
-            towns.update({station.town: [station]})
+            cells = [(row, col) for row in range(row_min, row_max + 1)
+                     for a, b in col_ranges for col in range(a, b + 1) if (row, col) in self._cells]
+
+        if not cells:
+            return np.empty(0, dtype=int)
+        return np.concatenate([self._cells[cell] for cell in cells])
 
-    return towns
+    def _query_radius(self, centre, r):
+        """Returns arrays of indices of the stations within a radius r (in km) of centre, and their
+        distances from centre"""
 
+        lat, lon = centre
 
-    
\ No newline at end of file
+        # Find box containing circle of radius r around centre
+        dlat = math.degrees(r / EARTH_RADIUS)
+        lat_min, lat_max = max(lat - dlat, -90), min(lat + dlat, 90)
+        if lat_min <= -90 or lat_max >= 90:
+            # Circle contains a pole, so includes all longitudes
+            dlon = 180
+        else:
+            dlon = math.degrees(math.asin(min(math.sin(r / EARTH_RADIUS) / math.cos(math.radians(lat)), 1)))
+        candidates = self._indices_in_box(lat_min, lat_max, lon - dlon, lon + dlon)
+
+        # Calculate exact distances for candidate stations
+        distances = haversine_distances(self.coords[candidates], centre)
+        within = distances < r
+        return candidates[within], distances[within]
+
+    def within_radius(self, centre, r):
+        """For a coordinate tuple (centre), returns a list of all the stations within a radius r (in km)
+        of the centre coordinate (in the same order as the list of stations)"""
+
+        indices, distances = self._query_radius(centre, r)
+        return [self.stations[i] for i in np.sort(indices)]
+
+    def nearest(self, p, k):
+        """For a coordinate tuple (p), returns a list of (station, distance) tuples of the k stations
+        nearest to p, sorted by distance"""
+
+        # Search increasing radii until k stations are found (the k nearest stations are then all within
+        # the radius)
+        r = max(self.cell_size * 111, 1)
+        while True:
+            indices, distances = self._query_radius(p, r)
+            if len(indices) >= k or r > math.pi * EARTH_RADIUS:
+                break
+            r *= 2
+
+        order = np.argsort(distances, kind='stable')[:k]
+        return [(self.stations[indices[i]], float(distances[i])) for i in order]
+
+    def within_box(self, lat_min, lat_max, lon_min, lon_max):
+        """Returns a list of all the stations with latitude from lat_min to lat_max, and longitude from
+        lon_min to lon_max (in the same order as the list of stations)"""
+
+        candidates = np.sort(self._indices_in_box(lat_min, lat_max, lon_min, lon_max))
+        lat, lon = self.lat[candidates], self.lon[candidates]
+        inside = (lat >= lat_min) & (lat <= lat_max) & (lon >= lon_min) & (lon <= lon_max)
+        return [self.stations[i] for i in candidates[inside]]
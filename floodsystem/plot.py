@@ -3,9 +3,8 @@
 """
 
 import matplotlib.pyplot as plt
-from matplotlib import dates as date
 from datetime import datetime, timedelta
-from .analysis import polyfit
+from .analysis import polyfit, evaluate_fit
 
 def prepare_water_levels_plot(current_plot, station, dates, levels):
     """For a MonitoringStation object (station), a list of dates (dates), a list of water levels (levels) and a plot,
@@ -63,12 +62,13 @@ def plot_water_level_with_fit(station, dates, levels, p):
     low, high = station.typical_range
 
     # Check if the levels list has any terms and change labels accordingly
-    if levels:
+    if len(levels):
 
-        #Obtain and plot polynomial expression (also calculate inputs for polynomial function)
-        poly, d0 = polyfit(dates, levels, p)
-        poly_x = date.date2num(dates) - d0
-        plt.plot(dates, poly(poly_x), label="Water Level Best Fit")
+        #Obtain and plot polynomial expression, evaluated at all dates at once (if the polynomial cannot be
+        #fitted, only the levels are plotted)
+        fit = polyfit(dates, levels, p)
+        if fit is not None:
+            plt.plot(dates, evaluate_fit(fit, dates), label="Water Level Best Fit")
 
         #Plot actual data
         plt.plot(dates, levels, label="Water Level")
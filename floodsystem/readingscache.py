@@ -0,0 +1,162 @@
+"""This module provides a persistent cache of the readings fetched for
+each measure, so that only readings newer than those already stored
+need to be fetched
+
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Default limits of a ReadingsCache, large enough to hold 10 days of 15
+# minute readings (960 readings) for every active measure (about 5000),
+# with room to spare, so that polling all stations does not evict
+# measures before they are used again
+MAX_MEASURES = 10000
+MAX_READINGS = MAX_MEASURES * 10 * 96
+
+
+class ReadingsCache:
+    """This class represents an on-disk cache of readings for measures.
+    Each measure's readings are stored in a separate file within the
+    cache directory, together with the start of the time window they
+    cover. The least recently used measures are evicted when the cache
+    holds more than max_measures measures or max_readings readings.
+
+    The index of measures is written after each put, or only once at the
+    end when puts are made within batch()."""
+
+    def __init__(self, directory, max_measures=MAX_MEASURES, max_readings=MAX_READINGS):
+
+        self._directory = directory
+        self.max_measures = max_measures
+        self.max_readings = max_readings
+
+        self._lock = threading.Lock()
+
+        # Number of open batches, and whether the index has changed since
+        # it was written
+        self._batch_depth = 0
+        self._index_changed = False
+
+        # Map from measure id to number of readings stored, ordered from
+        # least to most recently used
+        self._index = OrderedDict()
+        try:
+            with open(self._index_file(), 'r') as f:
+                self._index.update(json.load(f))
+        except (FileNotFoundError, ValueError):
+            pass
+        self._num_readings = sum(self._index.values())
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, measure_id):
+        return measure_id in self._index
+
+    def _index_file(self):
+        return os.path.join(self._directory, 'index.json')
+
+    def _measure_file(self, measure_id):
+        name = hashlib.sha1(measure_id.encode('utf-8')).hexdigest()
+        return os.path.join(self._directory, name + '.json')
+
+    def _write(self, filename, data):
+        """Write JSON object to file, replacing the file atomically"""
+        os.makedirs(self._directory, exist_ok=True)
+        tmp_file = '{}.{}.tmp'.format(filename, threading.get_ident())
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, filename)
+
+    def get(self, measure_id):
+        """Return the cached (start, items) for a measure, where start is
+        the ISO 8601 start time of the window covered by the readings
+        (items). Returns None if the measure is not cached."""
+
+        with self._lock:
+            if measure_id not in self._index:
+                return None
+            try:
+                with open(self._measure_file(measure_id), 'r') as f:
+                    entry = json.load(f)
+            except (FileNotFoundError, ValueError):
+                # Cache file missing or corrupt, so forget the measure
+                self._num_readings -= self._index.pop(measure_id)
+                return None
+
+            # Mark measure as most recently used
+            self._index.move_to_end(measure_id)
+
+        return entry['start'], entry['items']
+
+    def put(self, measure_id, start, items):
+        """Store the readings (items) for a measure, covering the window
+        from the ISO 8601 time start, evicting least recently used
+        measures if the cache is full"""
+
+        with self._lock:
+            self._write(self._measure_file(measure_id),
+                        {'measure': measure_id, 'start': start, 'items': items})
+            self._num_readings += len(items) - self._index.get(measure_id, 0)
+            self._index[measure_id] = len(items)
+            self._index.move_to_end(measure_id)
+
+            # Evict least recently used measures (but never the one just
+            # stored) until the cache is within its limits
+            while len(self._index) > 1 and (len(self._index) > self.max_measures
+                                            or self._num_readings > self.max_readings):
+                old_measure_id, num_readings = self._index.popitem(last=False)
+                self._num_readings -= num_readings
+                try:
+                    os.remove(self._measure_file(old_measure_id))
+                except FileNotFoundError:
+                    pass
+
+            # Write the index (if in a batch, this is done at the end)
+            self._index_changed = True
+            if not self._batch_depth:
+                self._write_index()
+
+    def _write_index(self):
+        self._write(self._index_file(), self._index)
+        self._index_changed = False
+
+    def flush(self):
+        """Write the index of measures if it has changed"""
+        with self._lock:
+            if self._index_changed:
+                self._write_index()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Context manager for storing many measures (e.g. from several
+        threads), which writes the index once at the end rather than
+        after each put. Batches can be nested."""
+
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._index_changed:
+                    self._write_index()
+
+    def clear(self):
+        """Remove all measures from the cache"""
+
+        with self._lock:
+            for measure_id in self._index:
+                try:
+                    os.remove(self._measure_file(measure_id))
+                except FileNotFoundError:
+                    pass
+            self._index.clear()
+            self._num_readings = 0
+            self._write_index()
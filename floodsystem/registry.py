@@ -0,0 +1,138 @@
+"""This module provides a wrapper around a list of monitoring stations
+which caches data derived from the stations
+
+"""
+
+import threading
+from collections import Counter
+
+from . import geo
+from .flood import relative_water_levels
+from .station import inconsistent_typical_range_stations
+from .stationindex import StationIndex
+
+# Derived views: map from view name to (function of the list of stations,
+# parts of the station data that the view depends on). 'stations' means
+# the stations in the list (and their names, ranges, etc.), and 'levels'
+# their latest levels.
+VIEWS = {
+    'stations_by_river': (geo.stations_by_river, ('stations',)),
+    'stations_by_town': (geo.stations_by_town, ('stations',)),
+    'rivers_with_station': (geo.rivers_with_station, ('stations',)),
+    'inconsistent_typical_range_stations': (inconsistent_typical_range_stations, ('stations',)),
+    'relative_water_levels': (relative_water_levels, ('stations', 'levels')),
+    'index': (StationIndex, ('stations',)),
+}
+
+
+class StationRegistry:
+    """This class represents a list of MonitoringStation objects (e.g. as
+    returned by build_station_list) together with views derived from it,
+    such as the stations on each river. Each view is computed the first
+    time it is needed and then cached, until the stations it depends on
+    change: adding or removing stations invalidates all views, while
+    updating water levels (update_water_levels and
+    update_water_level_histories do this automatically) only invalidates
+    views that depend on levels.
+
+    A StationRegistry can be used in place of a list of stations. Cached
+    views are shared, so they should not be modified. If station data is
+    changed directly, call invalidate('stations') or invalidate('levels').
+    """
+
+    def __init__(self, stations):
+
+        self.stations = list(stations)
+        self._lock = threading.RLock()
+
+        # Map from view name to cached view
+        self._views = {}
+
+        # Number of times each view was found in (hits) or missing from
+        # (misses) the cache
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def __len__(self):
+        return len(self.stations)
+
+    def __iter__(self):
+        return iter(self.stations)
+
+    def __getitem__(self, i):
+        return self.stations[i]
+
+    def __repr__(self):
+        return "StationRegistry({} stations, {} cached views)".format(len(self.stations), len(self._views))
+
+    def view(self, name):
+        """Returns the view called name (see VIEWS), computing it if it is
+        not cached"""
+
+        function, _ = VIEWS[name]
+        with self._lock:
+            if name in self._views:
+                self.hits[name] += 1
+            else:
+                self.misses[name] += 1
+                self._views[name] = function(self.stations)
+            return self._views[name]
+
+    def invalidate(self, dependency=None):
+        """Remove cached views that depend on dependency ('stations' or
+        'levels'), or all cached views if dependency is None"""
+
+        with self._lock:
+            for name in list(self._views):
+                if dependency is None or dependency in VIEWS[name][1]:
+                    del self._views[name]
+
+    def add(self, station):
+        """Add a MonitoringStation object to the registry"""
+        with self._lock:
+            self.stations.append(station)
+            self.invalidate('stations')
+
+    def remove(self, station):
+        """Remove a MonitoringStation object from the registry"""
+        with self._lock:
+            self.stations.remove(station)
+            self.invalidate('stations')
+
+    def stats(self):
+        """Returns a dictionary with the total number of cache hits and
+        misses"""
+        with self._lock:
+            return {'hits': sum(self.hits.values()), 'misses': sum(self.misses.values())}
+
+    def reset_stats(self):
+        """Reset the cache hit and miss counters"""
+        with self._lock:
+            self.hits.clear()
+            self.misses.clear()
+
+    def stations_by_river(self):
+        """Returns cached geo.stations_by_river for the stations"""
+        return self.view('stations_by_river')
+
+    def stations_by_town(self):
+        """Returns cached geo.stations_by_town for the stations"""
+        return self.view('stations_by_town')
+
+    def rivers_with_station(self):
+        """Returns cached geo.rivers_with_station for the stations"""
+        return self.view('rivers_with_station')
+
+    def inconsistent_typical_range_stations(self):
+        """Returns cached station.inconsistent_typical_range_stations for
+        the stations"""
+        return self.view('inconsistent_typical_range_stations')
+
+    def relative_water_levels(self):
+        """Returns cached flood.relative_water_levels for the stations"""
+        return self.view('relative_water_levels')
+
+    def index(self):
+        """Returns cached stationindex.StationIndex for the stations, for
+        looking up stations by station id, measure id or name"""
+        return self.view('index')
@@ -0,0 +1,111 @@
+"""This module provides a cache of station flood risk ratings, so that
+stations scored more than once (e.g. because they are in several towns)
+are only scored again when new level data arrives
+
+"""
+
+import threading
+from collections import OrderedDict
+
+from .trend import get_trend_store
+
+
+class RiskCache:
+    """This class represents a cache of station flood risk ratings (see
+    flood.get_station_flood_risk) for a scoring cycle. Ratings are stored
+    by measure id and trend estimator, together with the time and level of
+    the station's latest reading when the rating was calculated, and are
+    only used while these are unchanged. The least recently used ratings
+    are evicted when the cache holds more than max_entries ratings.
+
+    The times of the latest readings are taken from the TrendStore
+    (trends) given to update_water_levels, or the store returned by
+    trend.get_trend_store if None."""
+
+    def __init__(self, max_entries=10000, trends=None):
+
+        self.max_entries = max_entries
+        self.trends = trends
+        self._lock = threading.Lock()
+
+        # Map from (measure id, estimator) to (latest reading, rating),
+        # ordered from least to most recently used
+        self._entries = OrderedDict()
+
+        # Map from measure id to set of estimators with cached ratings
+        self._estimators = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _latest_reading(self, station):
+        """Return the time (date number) and level of the latest reading of
+        a station, as known to the trends (the time is None if not
+        known)"""
+        trends = self.trends if self.trends is not None else get_trend_store()
+        trend = trends.get(station.measure_id)
+        latest = trend.latest() if trend is not None else None
+        return (latest[0] if latest is not None else None), station.latest_level
+
+    def lookup(self, station, estimator='polyfit'):
+        """Returns a tuple (found, rating), where found is True if a rating
+        for a MonitoringStation object (station) is cached and still
+        valid, and rating is the rating (which can be None)"""
+
+        key = (station.measure_id, estimator)
+        latest = self._latest_reading(station)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != latest:
+                self.misses += 1
+                return False, None
+
+            # Mark rating as most recently used
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, station, rating, estimator='polyfit'):
+        """Store the rating for a MonitoringStation object (station),
+        evicting least recently used ratings if the cache is full"""
+
+        key = (station.measure_id, estimator)
+        latest = self._latest_reading(station)
+        with self._lock:
+            self._entries[key] = (latest, rating)
+            self._entries.move_to_end(key)
+            self._estimators.setdefault(station.measure_id, set()).add(estimator)
+
+            while len(self._entries) > self.max_entries:
+                (measure_id, old_estimator), _ = self._entries.popitem(last=False)
+                self._forget(measure_id, old_estimator)
+                self.evictions += 1
+
+    def _forget(self, measure_id, estimator):
+        estimators = self._estimators.get(measure_id)
+        if estimators is not None:
+            estimators.discard(estimator)
+            if not estimators:
+                del self._estimators[measure_id]
+
+    def invalidate(self, measure_id):
+        """Remove the ratings for a measure"""
+        with self._lock:
+            for estimator in self._estimators.pop(measure_id, ()):
+                del self._entries[(measure_id, estimator)]
+
+    def clear(self):
+        """Remove all ratings (e.g. at the start of a new scoring cycle)"""
+        with self._lock:
+            self._entries.clear()
+            self._estimators.clear()
+
+    def stats(self):
+        """Returns a dictionary with the number of cache hits, misses and
+        evictions"""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -9,6 +9,11 @@ for manipulating/modifying station data
 
 class MonitoringStation:
     """This class represents a river level monitoring station"""
+
+    # Use slots rather than a per-instance dictionary to reduce memory use
+    __slots__ = ('_station_id', '_measure_id', '_name', '_coord', '_typical_range', '_river', '_town',
+                 '_catchment', '_latest_level')
+
     def __init__(self, station_id, measure_id, label, coord, typical_range,
                  river, town, catchment):
 
@@ -63,12 +68,15 @@ class MonitoringStation:
         Note: "update_water_levels" function needs to be called at least once for this function to work."""
 
         # Check if typical range is consistent and there is a value for the latest level
-        if self.typical_range_consistent() and self._latest_level is not None:
+        # (uses properties, so that this method can be shared by StationView objects)
+        latest_level = self.latest_level
+        if self.typical_range_consistent() and latest_level is not None:
             # Calculate the difference between typical maximum and minimum
-            typical_difference = self._typical_range[1] - self._typical_range[0]
+            typical_range = self.typical_range
+            typical_difference = typical_range[1] - typical_range[0]
 
             # Return the shifted and scaled value for the latest level
-            return (self._latest_level - self._typical_range[0]) / typical_difference
+            return (latest_level - typical_range[0]) / typical_difference
 
         # Return "None" if the range is inconsistent or no latest level is recorded
         return None
@@ -122,7 +130,7 @@ class MonitoringStation:
         return self._river
 
     def set_river(self, value):
-        self._typical_range = value
+        self._river = value
 
     def del_river(self):
         del self._river
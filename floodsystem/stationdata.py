@@ -6,26 +6,35 @@ JSON objects fetched from the Internet and
 
 """
 
+import datetime
+import math
+import os
+import time
+import zipfile
+
 from . import datafetcher
 from .station import MonitoringStation
+from .stationindex import measure_positions
+from .stationtable import StationTable
+from .trend import get_trend_store
 
 
-def build_station_list(use_cache=True):
-    """Build and return a list of all river level monitoring stations
-    based on data fetched from the Environment agency. Each station is
-    represented as a MonitoringStation object.
-
-    The available data for some station is incomplete or not
-    available.
+def extract_station_fields(data):
+    """Extract the fields used to build MonitoringStation objects from
+    station data fetched from the Environment agency (either the JSON
+    object, or an iterable of its station items). Returns a dictionary of
+    columns (one entry per station in each column). Stations for which
+    required data is not available are skipped.
 
     """
 
-    # Fetch station data
-    data = datafetcher.fetch_station_data(use_cache)
+    fields = {'station_id': [], 'measure_id': [], 'label': [], 'lat': [], 'long': [],
+              'typical_low': [], 'typical_high': [], 'river': [], 'town': [], 'catchment': []}
 
-    # Build list of MonitoringStation objects
-    stations = []
-    for e in data["items"]:
+    if isinstance(data, dict):
+        data = data["items"]
+
+    for e in data:
 
         # Extract town string (not always available)
         town = None
@@ -43,55 +52,234 @@ def build_station_list(use_cache=True):
             catchment = e['catchmentName']
 
 
-        # Attempt to extract typical range (low, high)
+        # Attempt to extract typical range (low, high), using NaN if
+        # not available
         try:
             typical_range = (float(e['stageScale']['typicalRangeLow']),
                              float(e['stageScale']['typicalRangeHigh']))
         except Exception:
-            typical_range = None
+            typical_range = (float('nan'), float('nan'))
 
         try:
-            # Create mesure station object if all required data is
-            # available, and add to list
-            s = MonitoringStation(
-                station_id=e['@id'],
-                measure_id=e['measures'][-1]['@id'],
-                label=e['label'],
-                coord=(float(e['lat']), float(e['long'])),
-                typical_range=typical_range,
-                river=river,
-                town=town,
-                catchment=catchment)
-            stations.append(s)
+            # Extract required data. Handle case of erroneous data where
+            # data system returns '[label, label]' rather than 'label'
+            label = e['label']
+            if isinstance(label, list):
+                label = label[0]
+            station = (e['@id'], e['measures'][-1]['@id'], label, float(e['lat']), float(e['long']))
         except Exception:
             # Not all required data on the station was available, so
             # skip over
-            pass
+            continue
+
+        for name, value in zip(fields, station + typical_range + (river, town, catchment)):
+            fields[name].append(value)
+
+    return fields
+
+
+def _build_stations_from_fields(fields):
+    """Build list of MonitoringStation objects from station fields
+    (see extract_station_fields)"""
+
+    stations = []
+    for i in range(len(fields['station_id'])):
+
+        # Typical range is not available if stored as NaN
+        low, high = float(fields['typical_low'][i]), float(fields['typical_high'][i])
+        typical_range = None if math.isnan(low) or math.isnan(high) else (low, high)
+
+        s = MonitoringStation(
+            station_id=fields['station_id'][i],
+            measure_id=fields['measure_id'][i],
+            label=fields['label'][i],
+            coord=(float(fields['lat'][i]), float(fields['long'][i])),
+            typical_range=typical_range,
+            river=fields['river'][i],
+            town=fields['town'][i],
+            catchment=fields['catchment'][i])
+        stations.append(s)
 
     return stations
 
 
-def update_water_levels(stations):
-    """Attach level data contained in measure_data to stations"""
+def _load_station_fields_cache(cache_file):
+    """Load station fields from the binary cache file, returning None if
+    the file is not available, has expired or is older than the JSON
+    station data cache"""
+
+    try:
+        mtime = os.path.getmtime(cache_file)
+    except FileNotFoundError:
+        return None
+
+    # Check cache file has not expired and is up to date with the JSON
+    # station data
+    json_file = os.path.join('cache', 'station_data.json')
+    if time.time() - mtime > datafetcher.STATION_DATA_MAX_AGE.total_seconds():
+        return None
+    if os.path.exists(json_file) and os.path.getmtime(json_file) > mtime:
+        return None
+
+    try:
+        return datafetcher.load_columns(cache_file)
+    except (ValueError, OSError, KeyError, EOFError, zipfile.BadZipFile):
+        # Cache file in an old format, or corrupt (e.g. truncated)
+        return None
+
+
+def build_station_list(use_cache=True, stream=False, as_table=False):
+    """Build and return a list of all river level monitoring stations
+    based on data fetched from the Environment agency. Each station is
+    represented as a MonitoringStation object.
+
+    The available data for some station is incomplete or not
+    available.
+
+    If use_cache is True, the station fields are loaded from a compact
+    binary cache file if it is up to date, which is much faster than
+    loading the JSON station data. Otherwise the JSON station data is
+    used. If stream is True, the JSON station data is parsed
+    incrementally as it is downloaded (or read from file), so that the
+    whole JSON object is never held in memory.
+
+    If as_table is True, the stations are returned as a StationTable,
+    which stores the station data in columns (and can be used in place
+    of a list of MonitoringStation objects).
+
+    """
+
+    cache_file = os.path.join('cache', 'station_data.npz')
+
+    # Attempt to load station fields from binary cache file
+    fields = None
+    if use_cache:
+        fields = _load_station_fields_cache(cache_file)
+
+    if fields is None:
+        # Fetch station data, extract fields and save to binary cache file
+        data = datafetcher.fetch_station_data(use_cache, stream=stream)
+        fields = extract_station_fields(data)
+        datafetcher.dump_columns(fields, cache_file)
+
+    # Build table of stations or list of MonitoringStation objects
+    if as_table:
+        return StationTable(fields)
+    return _build_stations_from_fields(fields)
+
+
+def update_water_levels(stations, stream=False, trends=None):
+    """Attach level data contained in measure_data to stations. If stream
+    is True, the level data is parsed incrementally as it is downloaded
+    (or read from file). The latest readings of the stations are also
+    added to a TrendStore (trends, or the store returned by
+    trend.get_trend_store if None), to keep the trend of each station's
+    level up to date.
+
+    Only stations whose level has changed are updated. Returns a
+    dictionary of the changes, with 'changed' mapping to a list of
+    (station, old level, new level) tuples for stations with a new level,
+    and 'stale' to a list of stations whose level is no longer available
+    (so has been reset to None).
+
+    """
 
     # Fetch level data
-    measure_data = datafetcher.fetch_latest_water_level_data()
+    measure_data = datafetcher.fetch_latest_water_level_data(stream=stream)
+    if not stream:
+        measure_data = measure_data['items']
 
-    # Build map from measure id to latest reading (value)
-    measure_id_to_value = dict()
-    for measure in measure_data['items']:
+    # Find new level of each station (None if not available), using the
+    # map from measure id to station positions (from the cached index for
+    # a StationRegistry or StationTable)
+    station_list = stations if hasattr(stations, '__getitem__') else list(stations)
+    positions_by_measure_id = measure_positions(station_list)
+    levels = [None] * len(station_list)
+    readings = []
+    for measure in measure_data:
         if 'latestReading' in measure:
             latest_reading = measure['latestReading']
-            measure_id = latest_reading['measure']
-            measure_id_to_value[measure_id] = latest_reading['value']
+            level = latest_reading['value'] if isinstance(latest_reading['value'], float) else None
+            positions = positions_by_measure_id.get(latest_reading['measure'], ())
+            for i in positions:
+                levels[i] = level
+            if positions and level is not None and 'dateTime' in latest_reading:
+                readings.append(latest_reading)
+
+    # Add latest readings to the trends
+    if readings:
+        times, values = datafetcher.parse_readings(readings, as_array=True)
+        if trends is None:
+            trends = get_trend_store()
+        trends.update_many([reading['measure'] for reading in readings], times, values)
+
+    # Compare latest readings with station levels, and only update the
+    # stations where they differ
+    changes = {'changed': [], 'stale': []}
+    for station, level in zip(station_list, levels):
+        old_level = station.latest_level
+        if level == old_level:
+            continue
+        station.latest_level = level
+        if level is None:
+            changes['stale'].append(station)
+        else:
+            changes['changed'].append((station, old_level, level))
+
+    # If levels have changed, remove cached views that depend on them (for
+    # a StationRegistry)
+    if hasattr(stations, 'invalidate') and (changes['changed'] or changes['stale']):
+        stations.invalidate('levels')
+
+    return changes
+
 
-    # Attach latest reading to station objects
+def update_water_level_histories(stations, dt, as_array=False, trends=None):
+    """Fetch all level readings for the last period dt with a paged bulk
+    readings request (for all measures at once, in pages of up to
+    datafetcher.READINGS_LIMIT readings, rather than one request per
+    station), and return a dictionary mapping the measure id of each
+    station to its (dates, levels) tuple, as returned by
+    fetch_measure_levels (with NumPy arrays if as_array is True). The
+    latest level of each station is also updated to its latest reading,
+    and the readings are added to a TrendStore (trends, or the store
+    returned by trend.get_trend_store if None).
+
+    """
+
+    # Fetch readings for all measures
+    since = datetime.datetime.utcnow() - dt
+    readings = datafetcher.fetch_readings_since(since)
+
+    # Group readings by measure (readings remain sorted latest first),
+    # removing duplicate readings for the same time (readings which arrive
+    # while pages are fetched shift later pages, so some readings are
+    # fetched twice)
+    measure_id_to_readings = dict()
+    for reading in readings:
+        measure_id_to_readings.setdefault(reading['measure'], {}).setdefault(reading['dateTime'], reading)
+    measure_id_to_readings = {measure_id: list(measure_readings.values())
+                              for measure_id, measure_readings in measure_id_to_readings.items()}
+
+    # Attach readings to stations, and add them (oldest first) to the
+    # trends
+    if trends is None:
+        trends = get_trend_store()
+    histories = dict()
     for station in stations:
+        station_readings = measure_id_to_readings.get(station.measure_id, [])
+        times, values = datafetcher.parse_readings(station_readings, as_array=True)
+        trends.update_many([station.measure_id] * len(times), times[::-1], values[::-1])
+        histories[station.measure_id] = (times, values) if as_array else datafetcher.parse_readings(station_readings)
 
-        # Reset latestlevel
+        # Latest level is the latest reading with a value
         station.latest_level = None
+        for reading in station_readings:
+            if isinstance(reading.get('value'), float):
+                station.latest_level = reading['value']
+                break
+
+    if hasattr(stations, 'invalidate'):
+        stations.invalidate('levels')
 
-        # Atach new level data (if available)
-        if station.measure_id in measure_id_to_value:
-            if isinstance(measure_id_to_value[station.measure_id], float):
-                station.latest_level = measure_id_to_value[station.measure_id]
+    return histories
@@ -0,0 +1,114 @@
+"""This module provides indexes for looking up monitoring stations by
+station id, measure id and name
+
+"""
+
+import bisect
+import difflib
+import re
+
+
+def normalise_name(name):
+    """Returns a station name in a normalised form for searching: lower
+    case, with punctuation and repeated spaces replaced by single spaces"""
+    if name is None:
+        return ''
+    return ' '.join(re.sub(r'[^\w]+', ' ', name.casefold()).split())
+
+
+class StationIndex:
+    """This class represents hash indexes of a list of MonitoringStation
+    objects (stations) by station id, measure id and normalised name, for
+    looking up stations without checking every station. Stations are
+    stored in the index by their position in the list."""
+
+    def __init__(self, stations):
+
+        self.stations = stations if hasattr(stations, '__getitem__') else list(stations)
+
+        # Maps from station id to position, and from measure id and
+        # normalised name to lists of positions
+        self._station_id = {}
+        self._measure_id = {}
+        self._name = {}
+        for i, station in enumerate(self.stations):
+            self._station_id.setdefault(station.station_id, i)
+            self._measure_id.setdefault(station.measure_id, []).append(i)
+            self._name.setdefault(normalise_name(station.name), []).append(i)
+
+        # Sorted normalised names, for prefix search
+        self._names = sorted(self._name)
+
+    def __len__(self):
+        return len(self.stations)
+
+    def by_station_id(self, station_id):
+        """Returns the station with station id (station_id), or None if
+        there is no such station"""
+        i = self._station_id.get(station_id)
+        return None if i is None else self.stations[i]
+
+    def by_measure_id(self, measure_id):
+        """Returns a list of the stations with measure id (measure_id)"""
+        return [self.stations[i] for i in self._measure_id.get(measure_id, ())]
+
+    def positions_by_measure_id(self, measure_id):
+        """Returns a list of the positions in the list of stations of the
+        stations with measure id (measure_id)"""
+        return self._measure_id.get(measure_id, [])
+
+    def by_name(self, name):
+        """Returns a list of the stations with name (name), ignoring case
+        and punctuation"""
+        return [self.stations[i] for i in self._name.get(normalise_name(name), ())]
+
+    def search(self, prefix):
+        """Returns a list of the stations with names starting with prefix
+        (ignoring case and punctuation), sorted by name"""
+
+        prefix = normalise_name(prefix)
+
+        # Names with the prefix are consecutive in the sorted names
+        matches = []
+        for name in self._names[bisect.bisect_left(self._names, prefix):]:
+            if not name.startswith(prefix):
+                break
+            matches.extend(self.stations[i] for i in self._name[name])
+        return matches
+
+    def fuzzy_search(self, name, n=5, cutoff=0.6):
+        """Returns a list of the stations with names most similar to name
+        (at most n names with a similarity of at least cutoff, using
+        difflib.get_close_matches), most similar first"""
+
+        names = difflib.get_close_matches(normalise_name(name), self._names, n, cutoff)
+        return [self.stations[i] for match in names for i in self._name[match]]
+
+
+def station_index(stations):
+    """Returns a StationIndex for a list of MonitoringStation objects
+    (stations). The index is cached for a StationRegistry or StationTable
+    until the stations change."""
+
+    if hasattr(stations, 'view'):
+        return stations.view('index')
+    if hasattr(stations, 'cached'):
+        return stations.cached('index', StationIndex)
+    return StationIndex(stations)
+
+
+def measure_positions(stations):
+    """Returns a dictionary mapping each measure id to a list of the
+    positions of the stations with that measure id in a list of
+    MonitoringStation objects (stations). The map of the cached
+    StationIndex is used for a StationRegistry or StationTable; for other
+    lists, only this map is built, which is much quicker than building a
+    full StationIndex."""
+
+    if hasattr(stations, 'view') or hasattr(stations, 'cached'):
+        return station_index(stations)._measure_id
+
+    positions = {}
+    for i, station in enumerate(stations):
+        positions.setdefault(station.measure_id, []).append(i)
+    return positions
@@ -0,0 +1,257 @@
+"""This module provides a compact, column-based representation of a
+collection of monitoring stations
+
+"""
+
+import sys
+
+import numpy as np
+
+from .station import MonitoringStation
+
+
+def _encode_strings(values):
+    """For a list of strings (values, which may include None), return an
+    array of integer codes, a list of the unique (interned) strings that
+    the codes refer to and a dictionary mapping strings to codes. None is
+    encoded as -1."""
+
+    codes = np.empty(len(values), dtype=np.int32)
+    categories = []
+    lookup = {}
+    for i, value in enumerate(values):
+        if value is None:
+            codes[i] = -1
+            continue
+        code = lookup.get(value)
+        if code is None:
+            code = len(categories)
+            lookup[value] = code
+            categories.append(sys.intern(value))
+        codes[i] = code
+
+    return codes, categories, lookup
+
+
+class StationTable:
+    """This class represents a collection of monitoring stations stored as
+    columns. Coordinates, typical ranges and latest levels are stored in
+    NumPy arrays (NaN if not available), and river, town and catchment
+    names as integer codes into lists of unique names.
+
+    Indexing or iterating over a StationTable gives StationView objects,
+    which behave like MonitoringStation objects, so a StationTable can be
+    used in place of a list of stations."""
+
+    def __init__(self, fields):
+        """Create table from a dictionary of station fields (see
+        stationdata.extract_station_fields)"""
+
+        self.station_id = list(fields['station_id'])
+        self.measure_id = list(fields['measure_id'])
+        self.name = list(fields['label'])
+
+        self.lat = np.array(fields['lat'], dtype=np.float64)
+        self.lon = np.array(fields['long'], dtype=np.float64)
+        self.typical_low = np.array(fields['typical_low'], dtype=np.float64)
+        self.typical_high = np.array(fields['typical_high'], dtype=np.float64)
+        self.latest_level = np.full(len(self.station_id), np.nan)
+
+        # Encode name columns
+        self._codes = {}
+        self._categories = {}
+        self._lookup = {}
+        for column in ('river', 'town', 'catchment'):
+            self._codes[column], self._categories[column], self._lookup[column] = _encode_strings(fields[column])
+
+        # Incremented whenever station data (other than the latest level)
+        # changes, so that data derived from the table can be cached
+        self.version = 0
+        self._consistent_mask = None
+        self._cache = {}
+
+    @classmethod
+    def from_stations(cls, stations):
+        """Create table from a list of MonitoringStation objects (stations)"""
+
+        stations = list(stations)
+        ranges = [station.typical_range or (np.nan, np.nan) for station in stations]
+        table = cls({'station_id': [station.station_id for station in stations],
+                     'measure_id': [station.measure_id for station in stations],
+                     'label': [station.name for station in stations],
+                     'lat': [station.coord[0] for station in stations],
+                     'long': [station.coord[1] for station in stations],
+                     'typical_low': [r[0] for r in ranges],
+                     'typical_high': [r[1] for r in ranges],
+                     'river': [station.river for station in stations],
+                     'town': [station.town for station in stations],
+                     'catchment': [station.catchment for station in stations]})
+        table.latest_level[:] = [np.nan if station.latest_level is None else station.latest_level
+                                 for station in stations]
+        return table
+
+    def __len__(self):
+        return len(self.station_id)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [StationView(self, row) for row in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("station index out of range")
+        return StationView(self, i)
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield StationView(self, row)
+
+    def __repr__(self):
+        return "StationTable({} stations)".format(len(self))
+
+    def typical_range_consistent_mask(self):
+        """Returns a boolean array which is True for stations with
+        consistent typical range data (see
+        MonitoringStation.typical_range_consistent). The array is cached
+        until the table changes."""
+
+        if self._consistent_mask is None or self._consistent_mask[0] != self.version:
+            mask = ~np.isnan(self.typical_low) & ~np.isnan(self.typical_high)
+            mask[mask] = self.typical_high[mask] >= self.typical_low[mask]
+            self._consistent_mask = (self.version, mask)
+        return self._consistent_mask[1]
+
+    def cached(self, key, function):
+        """Returns function(self), which is cached (under key) until the
+        table changes. Used for data derived from the table, such as
+        groups of stations."""
+
+        entry = self._cache.get(key)
+        if entry is None or entry[0] != self.version:
+            entry = (self.version, function(self))
+            self._cache[key] = entry
+        return entry[1]
+
+    def codes(self, column):
+        """Returns the array of integer codes for a name column ('river',
+        'town' or 'catchment'), -1 where the name is not available"""
+        return self._codes[column]
+
+    def categories(self, column):
+        """Returns the list of unique names in a name column ('river',
+        'town' or 'catchment'), indexed by code"""
+        return self._categories[column]
+
+    def get_name(self, column, row):
+        """Returns the name in a name column for a row (None if not
+        available)"""
+        code = self._codes[column][row]
+        return None if code < 0 else self._categories[column][code]
+
+    def set_name(self, column, row, value):
+        """Sets the name in a name column for a row (None if not
+        available)"""
+        if value is None:
+            code = -1
+        else:
+            code = self._lookup[column].get(value)
+            if code is None:
+                code = len(self._categories[column])
+                self._lookup[column][value] = code
+                self._categories[column].append(sys.intern(value))
+        self._codes[column][row] = code
+        self.version += 1
+
+
+def _list_property(column, doc):
+    """Returns property for a row of a list column of a StationTable"""
+
+    def get(self):
+        return getattr(self._table, column)[self._row]
+
+    def set(self, value):
+        getattr(self._table, column)[self._row] = value
+        self._table.version += 1
+
+    return property(get, set, None, doc)
+
+
+def _name_property(column, doc):
+    """Returns property for a row of a name column of a StationTable"""
+
+    def get(self):
+        return self._table.get_name(column, self._row)
+
+    def set(self, value):
+        self._table.set_name(column, self._row, value)
+
+    return property(get, set, None, doc)
+
+
+class StationView:
+    """This class represents a monitoring station stored in a row of a
+    StationTable. It has the same properties and methods as a
+    MonitoringStation (including the get_ and set_ accessors, but not the
+    del_ accessors, as a row always has every attribute), which read and
+    write the table."""
+
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __eq__(self, other):
+        return isinstance(other, StationView) and self._table is other._table and self._row == other._row
+
+    def __hash__(self):
+        return hash((id(self._table), self._row))
+
+    def get_coord(self):
+        return (float(self._table.lat[self._row]), float(self._table.lon[self._row]))
+
+    def set_coord(self, value):
+        self._table.lat[self._row], self._table.lon[self._row] = value
+        self._table.version += 1
+
+    def get_typical_range(self):
+        low, high = self._table.typical_low[self._row], self._table.typical_high[self._row]
+        if np.isnan(low) or np.isnan(high):
+            return None
+        return (float(low), float(high))
+
+    def set_typical_range(self, value):
+        if value is None:
+            value = (np.nan, np.nan)
+        self._table.typical_low[self._row], self._table.typical_high[self._row] = (
+            np.nan if v is None else v for v in value)
+        self._table.version += 1
+
+    def get_latest_level(self):
+        level = self._table.latest_level[self._row]
+        return None if np.isnan(level) else float(level)
+
+    def set_latest_level(self, value):
+        self._table.latest_level[self._row] = np.nan if value is None else value
+
+    station_id = _list_property('station_id', "Station ID")
+    measure_id = _list_property('measure_id', "Measure ID")
+    name = _list_property('name', "Name")
+    coord = property(get_coord, set_coord, None, "Coordinates")
+    typical_range = property(get_typical_range, set_typical_range, None, "Typical range")
+    river = _name_property('river', "River")
+    town = _name_property('town', "Town")
+    latest_level = property(get_latest_level, set_latest_level, None, "Latest level")
+    catchment = _name_property('catchment', "Catchment")
+
+    get_station_id, set_station_id = station_id.fget, station_id.fset
+    get_measure_id, set_measure_id = measure_id.fget, measure_id.fset
+    get_name, set_name = name.fget, name.fset
+    get_river, set_river = river.fget, river.fset
+    get_town, set_town = town.fget, town.fset
+    get_catchment, set_catchment = catchment.fget, catchment.fset
+
+    # Methods are shared with MonitoringStation
+    __repr__ = MonitoringStation.__repr__
+    typical_range_consistent = MonitoringStation.typical_range_consistent
+    relative_water_level = MonitoringStation.relative_water_level
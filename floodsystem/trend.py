@@ -0,0 +1,162 @@
+"""This module provides running estimates of the trend (rate of rise) of
+the water level at each station, which are updated as new readings
+arrive rather than recalculated from the full level history
+
+"""
+
+import math
+import threading
+from collections import deque
+
+# Length of the window of readings (days) used for trends
+TREND_WINDOW = 2.0
+
+
+class OnlineTrend:
+    """This class represents the least squares straight line through the
+    readings of a measure in a window (of window days) up to the latest
+    reading. Running sums of the reading times and levels are updated as
+    readings are added and expire, so each update takes O(1) time.
+
+    Times are Matplotlib date numbers (days), so the slope is in levels
+    per day (the same as analysis.linear_slope of the readings in the
+    window)."""
+
+    def __init__(self, window=TREND_WINDOW):
+
+        self.window = window
+
+        # (time, level) of the readings in the window, oldest first
+        self._readings = deque()
+
+        # Sums over the readings of times (relative to _t0), levels, times
+        # squared and times multiplied by levels
+        self._t0 = None
+        self._sum_t = self._sum_y = self._sum_tt = self._sum_ty = 0.0
+
+    def __len__(self):
+        return len(self._readings)
+
+    def latest(self):
+        """Returns the (time, level) of the latest reading, or None if
+        there are no readings"""
+        return self._readings[-1] if self._readings else None
+
+    def _add_to_sums(self, t, y, sign):
+        t -= self._t0
+        self._sum_t += sign * t
+        self._sum_y += sign * y
+        self._sum_tt += sign * t * t
+        self._sum_ty += sign * t * y
+
+    def _rebase(self):
+        """Recalculate the sums relative to the oldest reading (which keeps
+        the sums accurate as time goes on)"""
+        self._t0 = self._readings[0][0]
+        self._sum_t = self._sum_y = self._sum_tt = self._sum_ty = 0.0
+        for t, y in self._readings:
+            self._add_to_sums(t, y, 1)
+
+    def update(self, t, y):
+        """Add a reading with time t and level y. Readings which are not
+        later than the latest reading, or have a missing (None or NaN)
+        level, are ignored. Returns True if the reading was added."""
+
+        if y is None or math.isnan(y) or (self._readings and t <= self._readings[-1][0]):
+            return False
+
+        if self._t0 is None:
+            self._t0 = t
+        self._readings.append((t, y))
+        self._add_to_sums(t, y, 1)
+
+        # Remove readings which are now outside the window
+        while self._readings[0][0] < t - self.window:
+            self._add_to_sums(*self._readings.popleft(), -1)
+
+        # Occasionally recalculate the sums, so that times stay close to
+        # _t0 and rounding errors do not build up
+        if t - self._t0 > 4 * self.window:
+            self._rebase()
+
+        return True
+
+    def slope(self):
+        """Returns the slope (levels per day) of the least squares straight
+        line through the readings in the window, or None if there are
+        fewer than two readings"""
+
+        n = len(self._readings)
+        if n < 2:
+            return None
+        denominator = n * self._sum_tt - self._sum_t * self._sum_t
+        if denominator <= 0:
+            return None
+        return (n * self._sum_ty - self._sum_t * self._sum_y) / denominator
+
+
+class TrendStore:
+    """This class represents the OnlineTrend objects of many measures, by
+    measure id"""
+
+    def __init__(self, window=TREND_WINDOW):
+        self.window = window
+        self._trends = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._trends)
+
+    def __contains__(self, measure_id):
+        return measure_id in self._trends
+
+    def get(self, measure_id):
+        """Returns the OnlineTrend of a measure, or None if there are no
+        readings for the measure"""
+        return self._trends.get(measure_id)
+
+    def update(self, measure_id, t, y):
+        """Add a reading with time t (date number) and level y for a
+        measure (see OnlineTrend.update)"""
+        with self._lock:
+            trend = self._trends.get(measure_id)
+            if trend is None:
+                trend = self._trends[measure_id] = OnlineTrend(self.window)
+            return trend.update(t, y)
+
+    def update_many(self, measure_ids, times, levels):
+        """Add readings for many measures, given as sequences of measure
+        ids, times and levels. Readings for each measure should be in
+        order of time. Returns the number of readings added."""
+        return sum(self.update(measure_id, float(t), float(y))
+                   for measure_id, t, y in zip(measure_ids, times, levels))
+
+    def slope(self, measure_id):
+        """Returns the current slope (levels per day) of the level of a
+        measure, or None if not available"""
+        with self._lock:
+            trend = self._trends.get(measure_id)
+            return None if trend is None else trend.slope()
+
+    def clear(self):
+        """Remove all readings"""
+        with self._lock:
+            self._trends.clear()
+
+
+# Trends updated by update_water_levels (created on first use, see
+# get_trend_store)
+_trend_store = None
+_trend_store_lock = threading.Lock()
+
+
+def get_trend_store():
+    """Return the store of trends updated by update_water_levels and used
+    by get_station_flood_risk (with estimator='online'), creating it if
+    required"""
+
+    global _trend_store
+    with _trend_store_lock:
+        if _trend_store is None:
+            _trend_store = TrendStore()
+        return _trend_store
@@ -1,11 +1,17 @@
 """Unit tests for analysis module"""
 
-from floodsystem.analysis import polyfit
+from floodsystem.analysis import polyfit, mean_gradients, pad_histories, polyfit_batch
+from floodsystem.analysis import TREND_ESTIMATORS, get_trend_estimator, theil_sen_slope
+from floodsystem.analysis import evaluate_fit, polyfit_slope
+import datetime
+import warnings
+import pytest
 from floodsystem.stationdata import build_station_list
 from floodsystem.stationdata import update_water_levels
 from floodsystem.datafetcher import fetch_measure_levels
 from datetime import timedelta
 from matplotlib import dates as date
+import numpy as np
 
 def test_analysis():
     stations = build_station_list()
@@ -25,4 +31,119 @@ def test_analysis():
 
         for i in range(len(times)):
             #Assert all polynomial values are within tolerance
-            assert abs(poly(numtimes[i] - d0) - values[i]) < tol
\ No newline at end of file
+            assert abs(poly(numtimes[i] - d0) - values[i]) < tol
+
+def test_polyfit_arrays():
+    """Tests subroutine polyfit with arrays of date numbers"""
+
+    #Quadratic water level over 2 days, sampled every 15 minutes
+    times = 19000 + np.arange(192) / 96
+    values = 0.5 * (times - times[0])**2 - (times - times[0]) + 1
+
+    poly, d0 = polyfit(times, values, p=2)
+
+    #Assert first date is offset and polynomial matches the levels
+    assert d0 == times[0]
+    assert np.allclose(poly(times - d0), values)
+
+
+def test_polyfit_batch():
+    """Tests subroutines pad_histories, polyfit_batch and mean_gradients"""
+
+    #Histories of different lengths (including empty, too short for the degree, and missing levels)
+    rng = np.random.default_rng(0)
+    histories = []
+    for n in [192, 150, 0, 3, 1, 100]:
+        times = 19000 + np.arange(n) / 96
+        histories.append((times, np.sin(3 * times) + rng.normal(0, 0.01, n)))
+    times = 19000 + np.arange(50) / 96
+    histories.append((times, np.where(np.arange(50) == 25, np.nan, np.sin(3 * times))))
+    histories.append((times[:3], [np.nan, 1.0, np.nan]))
+    histories.append((times, [np.nan] + [1.0] * 48 + [np.nan]))
+
+    times, values, lengths = pad_histories(histories)
+    assert times.shape == (9, 192) and list(lengths) == [192, 150, 0, 3, 1, 100, 50, 3, 50]
+    assert np.isnan(values[1, 150:]).all()
+
+    #Assert that fits match np.polyfit in terms of the scaled dates (ignoring missing levels)
+    coeffs, d0, span = polyfit_batch(times, values, lengths, p=4)
+    for i in (0, 1, 5, 6, 8):
+        dates, levels = histories[i]
+        valid = ~np.isnan(levels)
+        x = (dates[valid] - d0[i]) / span[i]
+        assert np.allclose(coeffs[i], np.polyfit(x, np.asarray(levels)[valid], 4)[::-1])
+    assert d0[8] == histories[8][0][1] and span[8] == histories[8][0][-2] - histories[8][0][1]
+    assert np.isnan(coeffs[[2, 4, 7]]).all()
+
+    #Assert that mean gradients are the average gradient of the fit at the dates with levels, as for
+    #polyfit_slope (including for histories with too few dates for the degree)
+    gradients = mean_gradients(histories, p=4, block_size=4)
+    for i in (0, 1, 3, 5, 6, 8):
+        dates, levels = histories[i]
+        valid = ~np.isnan(levels)
+        assert abs(gradients[i] - polyfit_slope(dates[valid], np.asarray(levels)[valid], p=4)) < 1e-6
+    assert np.isnan(gradients[[2, 4, 7]]).all()
+
+    #Assert that histories which are all empty give NaN, rather than an error
+    coeffs, d0, span = polyfit_batch(*pad_histories([([], []), ([], [])]), p=4)
+    assert coeffs.shape == (2, 5) and np.isnan(coeffs).all() and np.isnan(d0).all() and np.isnan(span).all()
+    assert np.isnan(mean_gradients([([], [])] * 3, p=4, block_size=2)).all()
+
+
+def test_trend_estimators():
+    """Tests the trend estimators in TREND_ESTIMATORS"""
+
+    #Level rising linearly at 0.2 m/day over 2 days, sampled every 15 minutes
+    times = 19000 + np.arange(192) / 96
+    levels = 1 + 0.2 * (times - times[0])
+
+    #Assert that every estimator finds the slope of a straight line
+    for name, estimator in TREND_ESTIMATORS.items():
+        assert get_trend_estimator(name) is estimator
+        assert abs(estimator(times, levels) - 0.2) < 1e-6
+
+    #Assert that Theil-Sen is not affected by a few outliers
+    levels[[10, 50, 100]] = 10
+    assert abs(theil_sen_slope(times, levels) - 0.2) < 1e-6
+
+    #Assert that estimators return None if all dates are the same
+    for name in ('linear', 'theil_sen', 'ew'):
+        assert TREND_ESTIMATORS[name](np.full(3, 19000.0), np.array([1.0, 2.0, 3.0])) is None
+
+    #Assert that functions can be used as estimators, and that unknown names are rejected
+    assert get_trend_estimator(len) is len
+    with pytest.raises(ValueError):
+        get_trend_estimator('cubic')
+
+
+def test_polyfit_missing_values():
+    """Tests subroutine polyfit with missing levels and poorly conditioned data"""
+
+    #Cubic water level over 2 days, sampled every 15 minutes, with missing levels
+    times = 19000 + np.arange(192) / 96
+    levels = list(0.1 * (times - times[0])**3 - (times - times[0]) + 1)
+    levels[10] = None
+    levels[20] = np.nan
+    levels[30] = [1.0, 2.0]
+
+    #Assert that the fit ignores missing levels, without warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        fit = polyfit(times, levels, p=4)
+    poly, d0 = fit
+    expected = 0.1 * (times - d0)**3 - (times - d0) + 1
+    assert np.allclose(evaluate_fit(fit, times), expected)
+    assert np.allclose(poly.deriv()(times - d0), 0.3 * (times - d0)**2 - 1)
+    assert abs(polyfit_slope(times, expected) - np.average(0.3 * (times - d0)**2 - 1)) < 1e-6
+
+    #Assert that datetimes can be used
+    dates = [datetime.datetime(2024, 1, 1) + datetime.timedelta(hours=i) for i in range(48)]
+    fit = polyfit(dates, [float(i) for i in range(48)], p=4)
+    assert np.allclose(evaluate_fit(fit, dates), np.arange(48))
+
+    #Assert that the degree is reduced for too few dates, and that no fit is returned without levels
+    poly, d0 = polyfit(times[:2], [1.0, 2.0], p=4)
+    assert poly.degree() == 1 and abs(poly(times[1] - d0) - 2) < 1e-9
+    assert polyfit(times[:3], [None, None, None], p=4) is None
+    assert polyfit([], [], p=4) is None
+    assert polyfit(times[:1], [1.0], p=4)[0](0) == 1.0
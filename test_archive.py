@@ -0,0 +1,42 @@
+"""Unit tests for the archive module"""
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from matplotlib import dates as date
+
+from floodsystem.archive import ReadingsArchive
+
+
+def test_readings_archive(tmp_path):
+    """Tests appending readings to and reading readings from a ReadingsArchive object"""
+
+    archive = ReadingsArchive(str(tmp_path))
+
+    # Readings every 15 minutes, latest first (as returned by fetch_measure_levels)
+    t0 = datetime(2022, 2, 1, tzinfo=timezone.utc)
+    dates = [t0 + timedelta(minutes=15 * i) for i in range(100)][::-1]
+    levels = [float(i) for i in range(100)][::-1]
+    levels[0] = None
+
+    # Assert that readings are appended, and only new readings are appended again
+    assert archive.append("m-1", dates[50:], levels[50:]) == 50
+    assert archive.append("m-1", dates, levels) == 50
+    assert archive.append("m-1", dates, levels) == 0
+    assert "m-1" in archive
+
+    # Assert that all readings are read in increasing order of time
+    times, values = ReadingsArchive(str(tmp_path)).read("m-1")
+    assert len(times) == len(values) == 100
+    assert np.all(np.diff(times) > 0)
+    assert times[0] == date.date2num(t0)
+    assert values[1] == 1.0
+    assert np.isnan(values[-1])
+
+    # Assert that a time range of readings is read
+    times, values = archive.read("m-1", t0 + timedelta(hours=1), t0 + timedelta(hours=2))
+    assert list(values) == [4.0, 5.0, 6.0, 7.0]
+
+    # Assert that a measure not in the archive has no readings
+    times, values = archive.read("m-2")
+    assert len(times) == len(values) == 0
@@ -4,8 +4,20 @@
 """Unit test for the stationdata module"""
 
 import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 
-from floodsystem.datafetcher import fetch_measure_levels
+import numpy as np
+from matplotlib import dates as date
+
+from floodsystem import datafetcher
+from floodsystem.datafetcher import fetch_measure_levels, fetch_measure_levels_many
+from floodsystem.datafetcher import fetch, configure_session, session_stats, reset_session_stats
+from floodsystem.datafetcher import fetch_station_data, iter_json_items
+from floodsystem.readingscache import ReadingsCache
 from floodsystem.stationdata import build_station_list
 
 
@@ -35,3 +47,389 @@ def test_build_station_list():
         station_cam.measure_id, dt=datetime.timedelta(days=dt))
     assert len(dates10) == len(levels10)
     assert len(dates10) > len(levels2)
+
+
+def test_fetch_measure_levels_many(monkeypatch):
+    """Tests subroutine fetch_measure_levels_many"""
+
+    # Replace the single measure fetch with one that records its calls
+    calls = []
+    chunk_threads = []
+
+    def fake_fetch_measure_levels(measure_id, dt, use_cache=False, archive=None, chunk_workers=4):
+        calls.append(measure_id)
+        chunk_threads.append(chunk_workers)
+        return [dt], [measure_id]
+
+    monkeypatch.setattr(datafetcher, "fetch_measure_levels", fake_fetch_measure_levels)
+
+    # Fetch data for a list of measures (including a duplicate)
+    dt = datetime.timedelta(days=2)
+    measure_ids = ["m-{}".format(i) for i in range(20)] + ["m-0"]
+    histories = fetch_measure_levels_many(measure_ids, dt, max_workers=4)
+
+    # Assert that each measure was only fetched once, and results are keyed by measure id
+    assert sorted(calls) == sorted(set(measure_ids))
+    assert len(histories) == 20
+    for measure_id in measure_ids:
+        assert histories[measure_id] == ([dt], [measure_id])
+
+    # Assert that an empty list of measures gives an empty result
+    assert fetch_measure_levels_many([], dt) == {}
+
+    # Assert that the total number of concurrent requests is limited to the
+    # connection pool size (16 by default)
+    for max_workers, expected in [(4, 4), (8, 2), (16, 1), (32, 1)]:
+        chunk_threads.clear()
+        fetch_measure_levels_many(measure_ids, dt, max_workers=max_workers)
+        assert set(chunk_threads) == {expected}
+
+
+def test_fetch_measure_levels_many_cache(monkeypatch, tmp_path):
+    """Tests fetching many measures with the readings cache"""
+
+    monkeypatch.chdir(tmp_path)
+    datafetcher.configure_readings_cache(max_measures=50, max_readings=1000)
+    cache = datafetcher.get_readings_cache()
+    assert (cache.max_measures, cache.max_readings) == (50, 1000)
+
+    # Replace the single measure fetch with one that stores readings in the cache, and records whether the
+    # cache index has been written
+    index_file = tmp_path / "cache" / "readings" / "index.json"
+    index_written = []
+
+    def fake_fetch_measure_levels(measure_id, dt, use_cache=False, chunk_workers=4):
+        datafetcher.get_readings_cache().put(measure_id, "2022-02-01T00:00:00", [])
+        index_written.append(index_file.exists())
+        return [], []
+    monkeypatch.setattr(datafetcher, "fetch_measure_levels", fake_fetch_measure_levels)
+
+    # Assert that the cache index is written once, at the end
+    fetch_measure_levels_many(["m-{}".format(i) for i in range(20)], datetime.timedelta(days=2), use_cache=True)
+    assert index_written == [False] * 20
+    assert len(json.loads(index_file.read_text())) == 20
+
+    datafetcher.configure_readings_cache()
+    assert datafetcher.get_readings_cache().max_measures == 10000
+
+
+def test_session_stats():
+    """Tests that requests are made through the shared, pooled session"""
+
+    # Local server returning a small JSON object over keep-alive connections
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            body = json.dumps({"items": [self.path]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}".format(server.server_port)
+
+    try:
+        configure_session(pool_size=4, timeout=5, retries=0)
+        reset_session_stats()
+
+        # Make several requests to the same host
+        for i in range(5):
+            assert fetch(url + "/{}".format(i)) == {"items": ["/{}".format(i)]}
+
+        # Assert that a single connection was opened and then reused
+        stats = session_stats()
+        assert stats["requests"] == 5
+        assert stats["connections"] == 1
+        assert stats["reused"] == 4
+        assert stats["latency"] > 0
+
+        # Assert that counters are reset
+        reset_session_stats()
+        assert session_stats()["requests"] == 0
+        assert session_stats()["connections"] == 0
+    finally:
+        server.shutdown()
+        server.server_close()
+        configure_session()
+
+
+def test_fetch_measure_levels_cached(monkeypatch, tmp_path):
+    """Tests that fetch_measure_levels only fetches new readings when using the readings cache"""
+
+    # Readings every 15 minutes up until now (latest first)
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    times = [now - datetime.timedelta(minutes=15 * i) for i in range(400)]
+    readings = [{"dateTime": t.isoformat() + "Z", "value": float(i)} for i, t in enumerate(times)]
+
+    # Replace fetch with one that serves readings since the time in the URL
+    urls = []
+
+    def fake_fetch(url):
+        urls.append(url)
+        since = datetime.datetime.fromisoformat(parse_qs(urlparse(url).query)["since"][0].rstrip("Z"))
+        return {"items": [r for r in readings if datetime.datetime.fromisoformat(r["dateTime"][:-1]) >= since]}
+
+    monkeypatch.setattr(datafetcher, "fetch", fake_fetch)
+    monkeypatch.setattr(datafetcher, "_readings_cache", ReadingsCache(str(tmp_path)))
+
+    # First fetch gets the full window
+    dates, levels = fetch_measure_levels("m-1", datetime.timedelta(days=2), use_cache=True)
+    assert len(dates) == len(levels) == 192
+
+    # Add a new reading and fetch again
+    readings.insert(0, {"dateTime": (now + datetime.timedelta(minutes=15)).isoformat() + "Z", "value": -1.0})
+    dates, levels = fetch_measure_levels("m-1", datetime.timedelta(days=2), use_cache=True)
+
+    # Assert that only readings since the latest cached reading were fetched
+    assert "since=" + now.isoformat() in urls[-1]
+
+    # Assert that results match an uncached fetch
+    assert (dates, levels) == fetch_measure_levels("m-1", datetime.timedelta(days=2))
+    assert levels[0] == -1.0
+
+
+def test_fetch_station_data_revalidation(monkeypatch, tmp_path):
+    """Tests expiry and conditional revalidation of the station data cache"""
+
+    # Replace conditional fetch with one that returns the data unless the ETag matches
+    calls = []
+
+    def fake_fetch_conditional(url, etag=None, last_modified=None):
+        calls.append(etag)
+        if etag == "v1":
+            return None, {"etag": "v1", "last_modified": None}
+        return {"items": ["station"]}, {"etag": "v1", "last_modified": None}
+
+    monkeypatch.setattr(datafetcher, "fetch_conditional", fake_fetch_conditional)
+    monkeypatch.chdir(tmp_path)
+
+    # First call fetches the data
+    assert fetch_station_data() == {"items": ["station"]}
+    assert calls == [None]
+
+    # Assert that cached data is used while it has not expired
+    assert fetch_station_data() == {"items": ["station"]}
+    assert calls == [None]
+
+    # Assert that expired data is revalidated with its ETag, and the cached copy is kept
+    assert fetch_station_data(max_age=datetime.timedelta(0)) == {"items": ["station"]}
+    assert calls == [None, "v1"]
+
+    # Assert that not using the cache always fetches the data
+    assert fetch_station_data(use_cache=False) == {"items": ["station"]}
+    assert calls == [None, "v1", None]
+
+
+def test_fetch_measure_levels_as_array(monkeypatch):
+    """Tests fetch_measure_levels returning NumPy arrays"""
+
+    items = [{"dateTime": "2022-02-01T10:15:00Z", "value": 0.5},
+             {"dateTime": "2022-02-01T10:00:00Z"},
+             {"dateTime": "2022-02-01T09:45:00Z", "value": 0.25}]
+    monkeypatch.setattr(datafetcher, "fetch", lambda url: {"items": items})
+
+    dates, levels = fetch_measure_levels("m-1", datetime.timedelta(days=2), as_array=True)
+    list_dates, list_levels = fetch_measure_levels("m-1", datetime.timedelta(days=2))
+
+    # Assert that dates are date numbers matching the dates returned as a list
+    assert dates.dtype == np.float64
+    assert np.allclose(dates, date.date2num(list_dates), rtol=0, atol=1e-9)
+
+    # Assert that missing values are NaN
+    assert levels[0] == 0.5
+    assert np.isnan(levels[1])
+    assert list_levels[1] is None
+
+
+def test_iter_json_items():
+    """Tests subroutine iter_json_items"""
+
+    data = {"@context": "http://example.com", "meta": {"limit": 3, "hasFormat": ["a", "b"]},
+            "items": [{"@id": "s-1", "lat": 52.25, "label": ["A", "A"]}, {"@id": "s-2", "value": 12345},
+                      [], "text \u00e9 \" ,]", 1e-3, None, True],
+            "count": 100}
+    text = json.dumps(data, indent=2)
+
+    # Assert that items are parsed for any split of the text into chunks
+    for chunk_size in (1, 2, 3, 7, 64, len(text)):
+        chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+        assert list(iter_json_items(chunks)) == data["items"]
+
+    # Assert that an object without items, or with an empty list of items, yields no items
+    assert list(iter_json_items(['{"meta": {}', ', "items": [ ]}'])) == []
+    assert list(iter_json_items(["{ }"])) == []
+
+
+def test_fetch_station_data_stream(monkeypatch, tmp_path):
+    """Tests streaming station items from the station data cache"""
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "cache").mkdir()
+    data = {"meta": {}, "items": [{"@id": "s-{}".format(i)} for i in range(1000)]}
+    datafetcher.dump(data, str(tmp_path / "cache" / "station_data.json"))
+
+    # Assert that items are streamed from the cache file
+    items = fetch_station_data(stream=True)
+    assert next(items) == {"@id": "s-0"}
+    assert list(items) == data["items"][1:]
+
+
+def test_fetch_station_data_stream_not_modified(monkeypatch, tmp_path):
+    """Tests that the cached validators are kept when a streamed request is
+    answered with 304 Not Modified without validators"""
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "cache").mkdir()
+    cache_file = str(tmp_path / "cache" / "station_data.json")
+    data = {"meta": {}, "items": [{"@id": "s-1"}]}
+    datafetcher.dump(data, cache_file)
+    datafetcher.dump({"fetched": 0, "etag": '"v1"', "last_modified": "Mon, 01 Jan 2024 00:00:00 GMT"},
+                     cache_file + ".info")
+
+    # Response with no headers
+    requests_headers = []
+
+    class NotModified:
+        status_code = 304
+        headers = {}
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+    def fake_get(url, headers=None, stream=False):
+        requests_headers.append(headers)
+        return NotModified()
+    monkeypatch.setattr(datafetcher, "_get", fake_get)
+
+    # Assert that cached items are used, and the validators are kept for the next request
+    for i in range(2):
+        assert list(fetch_station_data(max_age=datetime.timedelta(0), stream=True)) == data["items"]
+        assert requests_headers[i] == {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"}
+    info = datafetcher.load(cache_file + ".info")
+    assert info["etag"] == '"v1"' and info["last_modified"] == "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+def test_fetch_station_data_stale_while_revalidate(monkeypatch, tmp_path):
+    """Tests that expired station data is returned immediately and
+    revalidated in the background, with and without streaming"""
+
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "cache").mkdir()
+    cache_file = str(tmp_path / "cache" / "station_data.json")
+    old_data = {"meta": {}, "items": [{"@id": "s-1"}]}
+    new_data = {"meta": {}, "items": [{"@id": "s-1"}, {"@id": "s-2"}]}
+
+    # Replace conditional requests with ones that wait until released
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def fake_fetch_conditional(url, etag=None, last_modified=None):
+        calls.append(etag)
+        started.set()
+        assert release.wait(10)
+        return new_data, {"etag": '"v2"', "last_modified": None}
+    monkeypatch.setattr(datafetcher, "fetch_conditional", fake_fetch_conditional)
+
+    def fetch_items(stream):
+        if stream:
+            return list(fetch_station_data(stale_while_revalidate=True, stream=True))
+        return fetch_station_data(stale_while_revalidate=True)["items"]
+
+    for stream in (False, True):
+        # Expired cached data
+        datafetcher.dump(old_data, cache_file)
+        datafetcher.dump({"fetched": 0, "etag": '"v1"', "last_modified": None}, cache_file + ".info")
+        calls.clear()
+        started.clear()
+        release.clear()
+
+        # Assert that the stale data is returned while it is revalidated, and
+        # that only one revalidation runs at a time
+        assert fetch_items(stream) == old_data["items"]
+        assert started.wait(10)
+        assert fetch_items(stream) == old_data["items"]
+        assert calls == ['"v1"']
+
+        # Assert that the revalidated data is returned once the background
+        # revalidation has finished
+        release.set()
+        for _ in range(1000):
+            with datafetcher._revalidating_lock:
+                if not datafetcher._revalidating:
+                    break
+            time.sleep(0.01)
+        assert fetch_items(stream) == new_data["items"]
+        assert calls == ['"v1"']
+
+
+def test_fetch_measure_levels_chunked(monkeypatch):
+    """Tests fetching a long period of readings in chunks from a local stand-in server"""
+
+    # Readings every 15 minutes for the last 40 days (latest first)
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    readings = [{"dateTime": (now - datetime.timedelta(minutes=15 * i)).isoformat() + "Z", "value": float(i)}
+                for i in range(40 * 96)]
+
+    # Local server supporting the since, startdate, enddate, _limit and _offset parameters
+    requested = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            requested.append(query)
+            items = readings
+            if "since" in query:
+                since = query["since"][0].rstrip("Z")
+                items = [r for r in items if r["dateTime"].rstrip("Z") >= since]
+            if "startdate" in query:
+                items = [r for r in items if query["startdate"][0] <= r["dateTime"][:10] <= query["enddate"][0]]
+            offset = int(query.get("_offset", [0])[0])
+            limit = int(query.get("_limit", [500])[0])
+            body = json.dumps({"items": items[offset:offset + limit]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    measure_id = "http://127.0.0.1:{}/id/measures/m-1".format(server.server_port)
+    monkeypatch.setattr(datafetcher, "READINGS_LIMIT", 300)
+
+    try:
+        dt = datetime.timedelta(days=30)
+
+        # Fetch without splitting and in chunks of 7 days
+        dates, levels = fetch_measure_levels(measure_id, dt, chunk=None)
+        assert all("since" in query for query in requested)
+        n = len(requested)
+        chunked_dates, chunked_levels = fetch_measure_levels(measure_id, dt, chunk=datetime.timedelta(days=7))
+
+        # Assert that chunks were requested by date in pages
+        assert all("startdate" in query for query in requested[n:])
+        assert len(requested) - n > 5
+        assert all(int(query["_limit"][0]) == 300 for query in requested)
+
+        # Assert that chunked readings are stitched together in order
+        assert (chunked_dates, chunked_levels) == (dates, levels)
+        assert len(dates) == 30 * 96
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -4,11 +4,15 @@ from floodsystem.stationdata import build_station_list
 from floodsystem.stationdata import update_water_levels
 from floodsystem.flood import get_flood_risk_rating, get_level_rise, get_station_flood_risk, stations_highest_rel_level
 from floodsystem.flood import stations_level_over_threshold
-from floodsystem.flood import get_town_flood_risk
+from floodsystem.flood import get_town_flood_risk, score_all_towns
+from floodsystem.flood import relative_water_levels
+from floodsystem.analysis import mean_gradients
+from floodsystem.stationtable import StationTable
 from floodsystem.geo import stations_by_town
 from floodsystem.station import MonitoringStation
 from floodsystem.datafetcher import fetch_measure_levels
 from datetime import timedelta
+import numpy as np
 
 def test_stations_highest_rel_level():
     """Tests subroutine stations_highest_rel_level"""
@@ -73,6 +77,38 @@ def test_stations_level_over_threshold():
     # Assert the function does not crash if no stations are over the threshold or no latest level is given
     assert stations_level_over_threshold([test_station_3, test_station_4], 512) == []
 
+def test_relative_water_levels():
+    """Tests subroutine relative_water_levels, and threshold queries for a list or table of stations"""
+
+    # Create stations with a range of relative water levels (including not available)
+    typical_ranges = [(0, 1), (2, 3), (4, 5), None, (1, 0), (1, 1), (0, 2), (0, 4), (2, 3)]
+    latest_levels = [0.5, 4.5, None, 1.0, 0.5, 1.0, 3.0, 2.0, 2.5]
+    stations = []
+    for typical_range, latest_level in zip(typical_ranges, latest_levels):
+        station = MonitoringStation(None, None, None, (0, 0), typical_range, None, None, None)
+        station.latest_level = latest_level
+        stations.append(station)
+
+    for collection in (stations, StationTable.from_stations(stations)):
+        # Assert that relative levels match the relative levels of each station (NaN if not available)
+        relative_levels = relative_water_levels(collection)
+        for i, station in enumerate(stations):
+            if i == 5:
+                # Zero typical range
+                assert np.isnan(relative_levels[i])
+            elif station.relative_water_level() is None:
+                assert np.isnan(relative_levels[i])
+            else:
+                assert relative_levels[i] == station.relative_water_level()
+
+        # Assert that threshold and highest level queries give stations in descending order
+        over_threshold = stations_level_over_threshold(collection, 0.5)
+        assert [level for station, level in over_threshold] == [2.5, 1.5]
+        assert [station.relative_water_level() for station in stations_highest_rel_level(collection, 3)] == \
+            [2.5, 1.5, 0.5]
+        assert len(stations_highest_rel_level(collection, 100)) == 5
+        assert stations_highest_rel_level(collection, 0) == []
+
 def test_get_station_flood_risk():
     assert 0 == 0
 
@@ -117,6 +153,30 @@ def test_get_level_rise():
         if (times or values) == False:
             assert level_rise == None
 
+def test_get_level_rise_history():
+    """Tests subroutine get_level_rise with given level data"""
+
+    station = MonitoringStation(None, None, None, None, (0, 1), None, None, None)
+
+    #Level rising linearly at 0.2 m/day over 2 days
+    times = 19000 + np.arange(192) / 96
+    values = 0.2 * (times - times[0])
+    assert abs(get_level_rise(station, (times, values)) - 0.2) < 1e-6
+
+    #Assert that other trend estimators give the same rate for a straight line
+    for estimator in ('linear', 'theil_sen', 'ew'):
+        assert abs(get_level_rise(station, (times, values), estimator) - 0.2) < 1e-6
+    station.latest_level = 0.5
+    assert get_station_flood_risk(station, (times, values), estimator='linear') == 2
+
+    #Assert that missing levels are ignored, and that when there is no data (or only one level), level
+    #rise is None
+    values[5] = np.nan
+    assert abs(get_level_rise(station, (times, values)) - 0.2) < 1e-6
+    assert abs(get_level_rise(station, (times, list(values[:5]) + [None] + list(values[6:]))) - 0.2) < 1e-6
+    assert get_level_rise(station, ([], [])) is None
+    assert get_level_rise(station, (times[:3], [np.nan, 0.5, np.nan])) is None
+
 def test_get_town_flood_risk():
     """Tests subroutine get_town_flood_risk"""
 
@@ -140,6 +200,84 @@ def test_get_town_flood_risk():
     assert max_risk == town_flood_risk
 
 
+def test_score_all_towns():
+    """Tests subroutine score_all_towns"""
+
+    #Example stations, with the level rising, falling or flat over the last 2 days
+    times = 19000 + np.arange(192) / 96
+    rises = {"m-0": 0.5, "m-1": -0.5, "m-2": 0.0, "m-3": 0.5, "m-4": 0.5}
+    histories = {measure_id: (times, 1 + rise * (times - times[0])) for measure_id, rise in rises.items()}
+    stations = [MonitoringStation("s-{}".format(i), "m-{}".format(i), "Station {}".format(i), (52.0, 0.0),
+                                  (0.0, 1.0), "River", None, None) for i in range(5)]
+    for station, level in zip(stations, [3.0, 0.5, 0.5, 0.5, None]):
+        station.latest_level = level
+
+    #Towns share stations, and one town has a station without level data
+    towns = {"A": [stations[0], stations[1]], "B": [stations[1], stations[2]], "C": [stations[2], stations[3]],
+             "D": [stations[4]], "E": []}
+    expected = {"A": 4, "B": 1, "C": 2, "D": None, "E": None}
+
+    #Assert that results are the same with and without a process pool, and match get_town_flood_risk
+    for fit_workers in (0, 2):
+        town_risks, timings = score_all_towns(towns, fit_workers=fit_workers, histories=histories)
+        assert town_risks == expected
+        assert set(timings) == {'dedupe', 'fetch', 'fit', 'score'}
+    for town in "ABCD":
+        assert get_town_flood_risk(town, towns, histories=histories) == expected[town]
+
+    #Assert that stations which all have empty histories are not rated (as for get_level_rise)
+    empty = {measure_id: ([], []) for measure_id in rises}
+    assert get_level_rise(stations[0], empty["m-0"]) is None
+    assert score_all_towns(towns, histories=empty)[0] == {"A": None, "B": None, "C": None, "D": None, "E": None}
+
+
+def test_flat_level_flood_risk():
+    """Tests that stations with constant levels are rated as flat, not falling"""
+
+    #Constant levels over the last 2 days, for which fits give slopes of about +/-1e-16
+    rng = np.random.default_rng(2)
+    times = 19000 + np.arange(192) / 96
+    histories = {"m-{}".format(i): (times, np.full(192, rng.uniform(0, 5))) for i in range(200)}
+    stations = [MonitoringStation("s-{}".format(i), "m-{}".format(i), "Station {}".format(i), (52.0, 0.0),
+                                  (0.0, 1.0), "River", None, None) for i in range(200)]
+    for station in stations:
+        station.latest_level = 0.5
+
+    #Assert that every station is rated 1 (below the threshold, with no rise or fall)
+    for station in stations:
+        assert get_station_flood_risk(station, histories[station.measure_id]) == 1
+    town_risks, _ = score_all_towns({station.name: [station] for station in stations}, histories=histories)
+    assert set(town_risks.values()) == {1}
+
+
+def test_score_all_towns_matches_get_town_flood_risk():
+    """Tests that score_all_towns gives the same ratings as get_town_flood_risk"""
+
+    #Example stations with curved level histories (where the average gradient at the reading times
+    #differs from the gradient between the first and last readings), irregularly sampled and some with a
+    #missing level
+    rng = np.random.default_rng(1)
+    stations, histories = [], {}
+    for i in range(40):
+        times = 19000 + np.sort(rng.uniform(0, 2, 150 + i))
+        levels = 1 + 0.3 * np.sin(rng.uniform(1, 4) * (times - times[0]) + rng.uniform(0, 6))
+        if i % 5 == 0:
+            levels[len(levels) // 2] = np.nan
+        station = MonitoringStation("s-{}".format(i), "m-{}".format(i), "Station {}".format(i), (52.0, 0.0),
+                                    (0.0, 1.0), "River", None, None)
+        station.latest_level = rng.choice([0.5, 3.0])
+        stations.append(station)
+        histories[station.measure_id] = (times, levels)
+    towns = {"Town {}".format(i): stations[i:i + 3] for i in range(0, 40, 2)}
+
+    #Assert that level rises and town ratings match
+    gradients = mean_gradients([histories[station.measure_id] for station in stations])
+    for station, gradient in zip(stations, gradients):
+        assert abs(gradient - get_level_rise(station, histories[station.measure_id])) < 1e-9
+    town_risks, _ = score_all_towns(towns, histories=histories)
+    assert town_risks == {town: get_town_flood_risk(town, towns, histories=histories) for town in towns}
+
+
 def test_get_flood_risk_rating():
     """Tests subroutine flood_risk_rating"""
 
@@ -6,7 +6,14 @@ from floodsystem.geo import rivers_by_station_number
 from floodsystem.geo import stations_by_distance
 from floodsystem.geo import stations_by_river
 from floodsystem.geo import rivers_with_station
+from floodsystem.geo import SpatialIndex
+from floodsystem.geo import group_stations, stations_by_town
+from floodsystem.geo import river_station_counts
+from floodsystem.stationtable import StationTable
+from floodsystem.geo import haversine_distances, haversine_distance_matrix
+from floodsystem.station import MonitoringStation
 from haversine import haversine as hav  # haversine function for distance
+import numpy as np
 
 def test_stations_within_radius():
     """Tests subroutine stations_within_radius"""
@@ -185,3 +192,114 @@ def test_stations_by_river():
     for known_list, output_list in zip(known_stations.values(), all_stations):
         for known_station in known_list:
             assert known_station in output_list
+
+
+def random_stations(n, seed=0):
+    """Returns a list of n MonitoringStation objects at random locations"""
+    rng = np.random.default_rng(seed)
+    lats = np.degrees(np.arcsin(rng.uniform(-1, 1, n)))
+    lons = rng.uniform(-180, 180, n)
+    return [MonitoringStation("s-{}".format(i), None, "Station {}".format(i), (lat, lon), None, None, None, None)
+            for i, (lat, lon) in enumerate(zip(lats, lons))]
+
+
+def test_spatial_index():
+    """Tests radius, nearest and bounding box queries of SpatialIndex objects"""
+
+    stations = random_stations(2000)
+    index = SpatialIndex(stations, cell_size=5)
+
+    # Query points, including near the poles and the antimeridian
+    for centre in [(52.2053, 0.1218), (0, 179.5), (-89, -20), (88, 100), (10, -179.9)]:
+        # Assert that radius queries match checking every station
+        for r in (100, 1000, 5000, 25000):
+            assert index.within_radius(centre, r) == stations_within_radius(stations, centre, r)
+
+        # Assert that nearest queries match sorting every station by distance
+        for k in (1, 10, 2000):
+            nearest = index.nearest(centre, k)
+            assert [s for s, d in nearest] == [s for s, d in stations_by_distance(stations, centre)[:k]]
+            assert all(abs(d - hav(s.coord, centre)) < 1e-6 for s, d in nearest)
+
+    # Assert that bounding box queries match checking every station
+    box = (40, 60, -10, 10)
+    assert index.within_box(*box) == [s for s in stations if 40 <= s.coord[0] <= 60 and -10 <= s.coord[1] <= 10]
+
+
+def test_haversine_distances():
+    """Tests subroutines haversine_distances and haversine_distance_matrix"""
+
+    stations = random_stations(300, seed=1)
+    coords = [station.coord for station in stations]
+    p = (52.2053, 0.1218)
+
+    # Assert that distances from a point match the haversine function
+    distances = haversine_distances(coords, p)
+    assert np.allclose(distances, [hav(c, p) for c in coords], rtol=0, atol=1e-6)
+
+    # Assert that distances between all pairs match the haversine function, with blocks that do not
+    # divide the number of coordinates
+    matrix = haversine_distance_matrix(coords[:50], coords, block_size=16)
+    assert matrix.shape == (50, 300)
+    assert np.allclose(matrix, [[hav(c1, c2) for c2 in coords] for c1 in coords[:50]], rtol=0, atol=1e-6)
+
+    # Assert that list functions give the same results as the haversine function
+    assert stations_within_radius(stations, p, 2000) == [s for s in stations if hav(s.coord, p) < 2000]
+    assert [s for s, d in stations_by_distance(stations, p)] == sorted(stations, key=lambda s: hav(s.coord, p))
+
+
+def test_group_stations():
+    """Tests subroutines group_stations, stations_by_river and stations_by_town"""
+
+    s1 = MonitoringStation("s-1", "m-1", "A", (52.0, 0.0), None, "River Cam", "Cambridge", "Cam")
+    s2 = MonitoringStation("s-2", "m-2", "B", (52.1, 0.1), None, "River Cam", "Ely", "Cam")
+    s3 = MonitoringStation("s-3", "m-3", "C", (51.5, -0.1), None, "River Thames", "London", "Thames")
+    s4 = MonitoringStation(None, "m-4", "D", (51.6, -0.2), None, "River Thames", "London", "Thames")
+
+    # Assert that duplicate stations (same id, or same object without an id) are only included once
+    stations = [s1, s2, s3, s4, s1, MonitoringStation("s-2", "m-2", "B", (52.1, 0.1), None, "River Cam",
+                                                      "Ely", "Cam"), s4]
+    groups = group_stations(stations)
+    assert groups['river'] == {"River Cam": [s1, s2], "River Thames": [s3, s4]}
+    assert groups['town'] == {"Cambridge": [s1], "Ely": [s2], "London": [s3, s4]}
+    assert groups['catchment'] == {"Cam": [s1, s2], "Thames": [s3, s4]}
+    assert stations_by_river(stations) == groups['river']
+    assert stations_by_town(stations) == groups['town']
+    assert group_stations(stations)['river']["River Cam"] is not groups['river']["River Cam"]
+
+    # Assert that groups for a table are cached, cannot be modified, and are updated when the table changes
+    table = StationTable.from_stations([s1, s2, s3])
+    rivers = stations_by_river(table)
+    assert {river: [s.name for s in group] for river, group in rivers.items()} == {
+        "River Cam": ["A", "B"], "River Thames": ["C"]}
+    rivers["River Cam"].clear()
+    assert [s.name for s in stations_by_river(table)["River Cam"]] == ["A", "B"]
+    assert table.cached('groups', None) is table.cached('groups', None)
+    table[1].river = "River Ouse"
+    assert [s.name for s in stations_by_river(table)["River Ouse"]] == ["B"]
+    assert [s.name for s in stations_by_town(table)["Ely"]] == ["B"]
+
+
+def test_rivers_by_station_number_ties():
+    """Tests subroutines rivers_by_station_number and river_station_counts, with ties and values of N
+    greater than the number of rivers"""
+
+    numbers = {"A": 3, "B": 5, "C": 3, "D": 1, "E": 3}
+    stations = [MonitoringStation("{}-{}".format(river, i), None, "Station", (52.0, 0.0), None, river, None,
+                                  None) for river, n in numbers.items() for i in range(n)]
+
+    # Assert that duplicate stations are only counted once
+    assert river_station_counts(stations + stations[:4]) == numbers
+    assert river_station_counts(StationTable.from_stations(stations)) == numbers
+
+    # Assert that rivers with the same number of stations as the Nth entry are included (in order of
+    # first station)
+    assert rivers_by_station_number(stations, 1) == [("B", 5)]
+    assert rivers_by_station_number(stations, 2) == [("B", 5), ("A", 3), ("C", 3), ("E", 3)]
+    assert rivers_by_station_number(StationTable.from_stations(stations), 4) == [
+        ("B", 5), ("A", 3), ("C", 3), ("E", 3)]
+
+    # Assert that all rivers are returned if N is greater than the number of rivers
+    assert rivers_by_station_number(stations, 10) == [("B", 5), ("A", 3), ("C", 3), ("E", 3), ("D", 1)]
+    assert rivers_by_station_number(stations, 0) == []
+    assert rivers_by_station_number([], 3) == []
@@ -0,0 +1,82 @@
+"""Unit tests for the readingscache module"""
+
+from floodsystem.readingscache import ReadingsCache
+
+
+def test_readings_cache(tmp_path):
+    """Tests storing and retrieving readings from a ReadingsCache object"""
+
+    cache = ReadingsCache(str(tmp_path))
+    items = [{"dateTime": "2022-02-01T10:00:00Z", "value": 0.5}]
+
+    # Assert that a measure not in the cache is not found
+    assert cache.get("m-1") is None
+
+    # Assert that stored readings are retrieved
+    cache.put("m-1", "2022-02-01T00:00:00", items)
+    assert cache.get("m-1") == ("2022-02-01T00:00:00", items)
+
+    # Assert that the cache is persistent
+    assert ReadingsCache(str(tmp_path)).get("m-1") == ("2022-02-01T00:00:00", items)
+
+    # Assert that clearing the cache removes all measures
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.get("m-1") is None
+
+
+def test_readings_cache_eviction(tmp_path):
+    """Tests least recently used eviction from a ReadingsCache object"""
+
+    cache = ReadingsCache(str(tmp_path), max_measures=3, max_readings=10)
+    items = [{"dateTime": "2022-02-01T10:00:00Z", "value": 0.5}]
+
+    # Fill cache, then use first measure so that second is least recently used
+    for measure_id in ("m-1", "m-2", "m-3"):
+        cache.put(measure_id, "2022-02-01T00:00:00", items)
+    cache.get("m-1")
+
+    # Assert that adding a fourth measure evicts the least recently used measure
+    cache.put("m-4", "2022-02-01T00:00:00", items)
+    assert len(cache) == 3
+    assert "m-2" not in cache
+    assert "m-1" in cache
+
+    # Assert that exceeding the maximum number of readings evicts measures
+    cache.put("m-5", "2022-02-01T00:00:00", items * 10)
+    assert "m-5" in cache
+    assert len(cache) == 1
+
+
+def test_readings_cache_batch(tmp_path, monkeypatch):
+    """Tests writing the index once for a batch of measures"""
+
+    # Assert that the default limits hold 10 days of 15 minute readings for every active measure
+    cache = ReadingsCache(str(tmp_path))
+    assert cache.max_measures >= 5000 and cache.max_readings >= 5000 * 10 * 96
+
+    # Count index writes
+    writes = []
+    write = cache._write
+
+    def counting_write(filename, data):
+        if filename.endswith("index.json"):
+            writes.append(len(data))
+        write(filename, data)
+    monkeypatch.setattr(cache, "_write", counting_write)
+
+    # Assert that the index is written once at the end of a (nested) batch, and after each put otherwise
+    items = [{"dateTime": "2022-02-01T10:00:00Z", "value": 0.5}]
+    with cache.batch():
+        with cache.batch():
+            for i in range(5):
+                cache.put("m-{}".format(i), "2022-02-01T00:00:00", items)
+        assert writes == []
+    assert writes == [5]
+    assert len(ReadingsCache(str(tmp_path))) == 5
+    cache.put("m-5", "2022-02-01T00:00:00", items)
+    assert writes == [5, 6]
+
+    # Assert that flushing only writes a changed index
+    cache.flush()
+    assert writes == [5, 6]
@@ -0,0 +1,48 @@
+"""Unit tests for the registry module"""
+
+import numpy as np
+
+from floodsystem import datafetcher
+from floodsystem.registry import StationRegistry
+from floodsystem.station import MonitoringStation
+from floodsystem.stationdata import update_water_levels
+
+
+def test_station_registry(monkeypatch):
+    """Tests caching and invalidation of views of a StationRegistry object"""
+
+    # Stations on two rivers: one with a consistent typical range, one without a range and one with an
+    # inconsistent range
+    stations = [MonitoringStation("s-cam", "m-cam", "Cam", (52.2, 0.1), (0.1, 0.9), "River A", "Cambridge", None),
+                MonitoringStation("s-ely", "m-ely", "Ely", (52.4, 0.3), None, "River B", "Ely", None),
+                MonitoringStation("s-bed", "m-bed", "Bedford", (52.1, -0.5), (2.0, 1.0), "River A", "Bedford", None)]
+    registry = StationRegistry(stations)
+    assert len(registry) == 3 and list(registry) == stations and registry[0] is stations[0]
+
+    # Assert that views are computed once and then cached
+    rivers = registry.stations_by_river()
+    assert rivers == {"River A": [stations[0], stations[2]], "River B": [stations[1]]}
+    assert registry.stations_by_river() is rivers
+    assert registry.rivers_with_station() == {"River A", "River B"}
+    assert registry.inconsistent_typical_range_stations() == [stations[1], stations[2]]
+    assert registry.stats() == {'hits': 1, 'misses': 3}
+
+    # Assert that updating levels only invalidates views which depend on levels
+    assert np.isnan(registry.relative_water_levels()).all()
+    monkeypatch.setattr(datafetcher, "fetch_latest_water_level_data", lambda stream=False: {
+        "items": [{"latestReading": {"measure": "m-cam", "value": 0.5}}]})
+    update_water_levels(registry)
+    assert np.allclose(registry.relative_water_levels()[0], 0.5)
+    assert registry.stations_by_river() is rivers
+    assert registry.misses["relative_water_levels"] == 2
+    assert registry.hits["stations_by_river"] == 2
+
+    # Assert that adding and removing stations invalidates views
+    registry.add(MonitoringStation("s-ouse", "m-ouse", "Ouse", (52.0, -0.7), None, "River C", None, None))
+    assert set(registry.stations_by_river()) == {"River A", "River B", "River C"}
+    registry.remove(stations[1])
+    assert registry.rivers_with_station() == {"River A", "River C"}
+    assert len(registry.relative_water_levels()) == 3
+
+    registry.reset_stats()
+    assert registry.stats() == {'hits': 0, 'misses': 0}
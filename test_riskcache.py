@@ -0,0 +1,125 @@
+"""Unit tests for the riskcache module"""
+
+import numpy as np
+
+from floodsystem import flood, trend
+from floodsystem.flood import get_station_flood_risk, get_town_flood_risk, score_all_towns
+from floodsystem.riskcache import RiskCache
+from floodsystem.station import MonitoringStation
+from floodsystem.trend import TrendStore
+
+
+def example_station(i, level=0.5):
+    """Returns an example MonitoringStation object"""
+    station = MonitoringStation("s-{}".format(i), "m-{}".format(i), "Station {}".format(i), (52.0, 0.0),
+                                (0.0, 1.0), "River", "Town", None)
+    station.latest_level = level
+    return station
+
+
+def test_risk_cache(monkeypatch):
+    """Tests that ratings are reused until new readings arrive, and
+    invalidation and eviction"""
+
+    store = TrendStore()
+    monkeypatch.setattr(trend, "_trend_store", store)
+    cache = RiskCache(max_entries=2)
+    station = example_station(0)
+
+    # Count level data fetches
+    fetches = []
+
+    def fake_fetch_measure_levels(measure_id, dt, as_array=False):
+        fetches.append(measure_id)
+        times = 19000 + np.arange(192) / 96
+        return times, 0.5 + 0.2 * (times - times[0])
+    monkeypatch.setattr(flood, "fetch_measure_levels", fake_fetch_measure_levels)
+
+    # Assert that the rating is only calculated once for the same reading
+    store.update("m-0", 19001.0, 0.5)
+    assert get_station_flood_risk(station, cache=cache) == 2
+    assert get_station_flood_risk(station, cache=cache) == 2
+    assert fetches == ["m-0"] and cache.stats() == {'hits': 1, 'misses': 1, 'evictions': 0}
+
+    # Assert that the rating is calculated again for a new reading, or a new level
+    store.update("m-0", 19001.01, 0.5)
+    get_station_flood_risk(station, cache=cache)
+    station.latest_level = 0.6
+    get_station_flood_risk(station, cache=cache)
+    assert len(fetches) == 3
+
+    # Assert that ratings for different estimators are cached separately, and can be invalidated
+    get_station_flood_risk(station, estimator='linear', cache=cache)
+    assert len(fetches) == 4 and len(cache) == 2
+    cache.invalidate("m-0")
+    assert len(cache) == 0
+    get_station_flood_risk(station, cache=cache)
+    assert len(fetches) == 5
+
+    # Assert that the least recently used ratings are evicted
+    for i in (1, 2):
+        get_station_flood_risk(example_station(i), cache=cache)
+    assert len(cache) == 2 and cache.stats()['evictions'] == 1
+    assert cache.lookup(station) == (False, None)
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_risk_cache_trends(monkeypatch):
+    """Tests a RiskCache using the TrendStore given to update_water_levels"""
+
+    store = TrendStore()
+    monkeypatch.setattr(trend, "_trend_store", TrendStore())
+    cache = RiskCache(trends=store)
+    station = example_station(0)
+    times = 19000 + np.arange(192) / 96
+    history = (times, 0.5 + 0.2 * (times - times[0]))
+
+    # Assert that a new reading in the given store (with the same level)
+    # invalidates the rating, and that the global store is not used
+    store.update("m-0", 19001.0, 0.5)
+    get_station_flood_risk(station, history, cache=cache)
+    assert cache.lookup(station) == (True, 2)
+    trend.get_trend_store().update("m-0", 19001.01, 0.5)
+    assert cache.lookup(station) == (True, 2)
+    store.update("m-0", 19001.01, 0.5)
+    assert cache.lookup(station) == (False, None)
+
+
+def test_town_risk_cache(monkeypatch):
+    """Tests that stations shared between towns are only scored once with a
+    RiskCache"""
+
+    monkeypatch.setattr(trend, "_trend_store", TrendStore())
+    times = 19000 + np.arange(192) / 96
+    histories = {"m-{}".format(i): (times, 0.5 + 0.2 * (times - times[0])) for i in range(3)}
+    stations = [example_station(i) for i in range(3)]
+    towns = {"A": stations[:2], "B": stations[1:]}
+
+    fetched = []
+
+    def fake_fetch_measure_levels_many(measure_ids, dt, max_workers=8, **kwargs):
+        fetched.extend(measure_ids)
+        return {measure_id: histories[measure_id] for measure_id in measure_ids}
+    monkeypatch.setattr(flood, "fetch_measure_levels_many", fake_fetch_measure_levels_many)
+
+    cache = RiskCache()
+    assert get_town_flood_risk("A", towns, cache=cache) == 2
+    assert get_town_flood_risk("B", towns, cache=cache) == 2
+    assert fetched == ["m-0", "m-1", "m-2"]
+
+    # Assert that scoring all towns again only uses cached ratings (shared
+    # between get_town_flood_risk and score_all_towns)
+    fetched.clear()
+    assert get_town_flood_risk("A", towns, cache=cache) == 2
+    assert score_all_towns(towns, cache=cache)[0] == {"A": 2, "B": 2}
+    assert fetched == []
+
+    # Assert that ratings from score_all_towns are used by
+    # get_town_flood_risk
+    cache.clear()
+    assert score_all_towns(towns, cache=cache)[0] == {"A": 2, "B": 2}
+    assert fetched == ["m-0", "m-1", "m-2"]
+    assert get_town_flood_risk("B", towns, cache=cache) == 2
+    assert score_all_towns(towns, cache=cache)[0] == {"A": 2, "B": 2}
+    assert fetched == ["m-0", "m-1", "m-2"]
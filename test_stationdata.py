@@ -3,7 +3,24 @@
 # SPDX-License-Identifier: MIT
 """Unit test for the stationdata module"""
 
-from floodsystem.stationdata import build_station_list, update_water_levels
+from floodsystem import datafetcher
+import datetime
+
+import numpy as np
+
+from floodsystem.station import MonitoringStation
+from floodsystem.stationdata import build_station_list, update_water_levels, extract_station_fields
+from floodsystem.stationdata import update_water_level_histories
+
+# Example station data, in the format returned by the Environment agency
+# (the last station is missing required data)
+example_station_data = {"items": [
+    {"@id": "s-1", "label": "Station 1", "lat": 52.2, "long": 0.1, "town": "Town 1", "riverName": "River 1",
+     "catchmentName": "Catchment 1", "measures": [{"@id": "m-1"}],
+     "stageScale": {"typicalRangeLow": 0.1, "typicalRangeHigh": 0.9}},
+    {"@id": "s-2", "label": ["Station 2", "Station 2"], "lat": "51.5", "long": "-0.5",
+     "measures": [{"@id": "m-0"}, {"@id": "m-2"}]},
+    {"@id": "s-3", "label": "Station 3", "lat": 50.0}]}
 
 
 def test_build_station_list():
@@ -28,3 +45,128 @@ def test_update_level():
             counter += 1
 
     assert counter > 0
+
+
+def test_extract_station_fields():
+    """Tests subroutine extract_station_fields"""
+
+    fields = extract_station_fields(example_station_data)
+
+    # Assert that the station missing required data is skipped
+    assert fields["station_id"] == ["s-1", "s-2"]
+    assert fields["measure_id"] == ["m-1", "m-2"]
+    assert fields["label"] == ["Station 1", "Station 2"]
+    assert fields["lat"] == [52.2, 51.5]
+    assert fields["town"] == ["Town 1", None]
+    assert fields["typical_low"][0] == 0.1
+
+
+def test_build_station_list_binary_cache(monkeypatch, tmp_path):
+    """Tests building list of stations from the binary station cache"""
+
+    # Replace station data fetch with one that returns the example data
+    calls = []
+
+    def fake_fetch_station_data(use_cache=True, stream=False):
+        calls.append(use_cache)
+        return example_station_data
+
+    monkeypatch.setattr(datafetcher, "fetch_station_data", fake_fetch_station_data)
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "cache").mkdir()
+
+    # Build station list twice, the second time from the binary cache
+    stations = build_station_list()
+    cached_stations = build_station_list()
+    assert len(calls) == 1
+
+    # Assert that the stations are the same
+    assert len(cached_stations) == 2
+    for s, c in zip(stations, cached_stations):
+        assert repr(s) == repr(c)
+    assert cached_stations[0].typical_range == (0.1, 0.9)
+    assert cached_stations[1].typical_range is None
+    assert cached_stations[1].town is None
+    assert cached_stations[1].coord == (51.5, -0.5)
+
+    # Assert that stations can be built as a table
+    table = build_station_list(as_table=True)
+    assert [repr(s) for s in table] == [repr(s) for s in stations]
+
+    # Assert that not using the cache fetches the data again
+    build_station_list(use_cache=False)
+    assert calls == [True, False]
+
+    # Assert that a corrupt (truncated or empty) binary cache is ignored, and the station data is
+    # used instead
+    cache_file = tmp_path / "cache" / "station_data.npz"
+    for size in (cache_file.stat().st_size // 2, 0):
+        with open(cache_file, "r+b") as f:
+            f.truncate(size)
+        assert [repr(s) for s in build_station_list()] == [repr(s) for s in stations]
+        assert calls[-1] is True
+
+
+def test_update_water_level_histories(monkeypatch):
+    """Tests updating level histories of stations from a bulk readings fetch"""
+
+    # Readings for three measures (latest first), one of which has no station, with repeated readings (as
+    # when readings arrive between pages)
+    readings = [{"measure": "m-1", "dateTime": "2022-02-01T10:15:00Z", "value": 0.7},
+                {"measure": "m-3", "dateTime": "2022-02-01T10:15:00Z", "value": 9.0},
+                {"measure": "m-2", "dateTime": "2022-02-01T10:15:00Z"},
+                {"measure": "m-2", "dateTime": "2022-02-01T10:15:00Z"},
+                {"measure": "m-2", "dateTime": "2022-02-01T10:00:00Z", "value": 0.2},
+                {"measure": "m-1", "dateTime": "2022-02-01T10:15:00Z", "value": 0.7},
+                {"measure": "m-1", "dateTime": "2022-02-01T10:00:00Z", "value": 0.6}]
+    calls = []
+
+    def fake_fetch_readings_since(since):
+        calls.append(since)
+        return readings
+
+    monkeypatch.setattr(datafetcher, "fetch_readings_since", fake_fetch_readings_since)
+
+    stations = [MonitoringStation("s-{}".format(i), "m-{}".format(i), "Station", (0, 0), (0, 1), None, None, None)
+                for i in (1, 2, 4)]
+    histories = update_water_level_histories(stations, datetime.timedelta(days=2), as_array=True)
+
+    # Assert that readings were fetched in a single request
+    assert len(calls) == 1
+
+    # Assert that readings are attached to the right stations
+    assert list(histories["m-1"][1]) == [0.7, 0.6]
+    assert np.isnan(histories["m-2"][1][0]) and len(histories["m-2"][1]) == 2
+    assert len(histories["m-4"][0]) == 0
+    assert "m-3" not in histories
+
+    # Assert that latest levels are updated from the latest readings with a value
+    assert [station.latest_level for station in stations] == [0.7, 0.2, None]
+
+
+def test_update_water_levels_changes(monkeypatch):
+    """Tests that update_water_levels only updates changed levels, and
+    returns the changes"""
+
+    stations = [MonitoringStation("s-{}".format(i), "m-{}".format(i), "Station {}".format(i), (52.0, 0.0),
+                                  (0.0, 1.0), "River", "Town", None) for i in range(4)]
+
+    def fake_fetch_latest_water_level_data(stream=False):
+        return {"items": [{"latestReading": {"measure": measure_id, "value": value}}
+                          for measure_id, value in readings.items()]}
+    monkeypatch.setattr(datafetcher, "fetch_latest_water_level_data", fake_fetch_latest_water_level_data)
+
+    # Assert that all new levels are returned the first time
+    readings = {"m-0": 0.5, "m-1": 0.7, "m-2": [0.1, 0.2]}
+    changes = update_water_levels(stations)
+    assert changes == {'changed': [(stations[0], None, 0.5), (stations[1], None, 0.7)], 'stale': []}
+    assert [station.latest_level for station in stations] == [0.5, 0.7, None, None]
+
+    # Assert that only changed and stale levels are returned the next time
+    readings = {"m-0": 0.5, "m-2": 0.3, "m-3": 0.9}
+    changes = update_water_levels(stations)
+    assert changes == {'changed': [(stations[2], None, 0.3), (stations[3], None, 0.9)], 'stale': [stations[1]]}
+    assert [station.latest_level for station in stations] == [0.5, None, 0.3, 0.9]
+
+    # Assert that there are no changes if the readings are the same
+    assert update_water_levels(stations) == {'changed': [], 'stale': []}
@@ -0,0 +1,69 @@
+"""Unit tests for the stationindex module"""
+
+from floodsystem.registry import StationRegistry
+from floodsystem.station import MonitoringStation
+from floodsystem.stationindex import StationIndex, measure_positions, normalise_name, station_index
+from floodsystem.stationtable import StationTable
+
+
+def example_stations():
+    """Returns a list of example MonitoringStation objects"""
+    names = ["Cam", "Cambridge Jesus Lock", "Cambridge", "St. Ives", "Ely", "Camden"]
+    return [MonitoringStation("s-{}".format(i), "m-{}".format(i % 5), name, (52.0, 0.0), None, "River", "Town",
+                              None) for i, name in enumerate(names)]
+
+
+def test_station_index():
+    """Tests looking up stations using a StationIndex object"""
+
+    stations = example_stations()
+    index = StationIndex(stations)
+
+    # Assert that stations are found by station id, measure id and name
+    assert index.by_station_id("s-3") is stations[3]
+    assert index.by_station_id("s-9") is None
+    assert index.by_measure_id("m-0") == [stations[0], stations[5]]
+    assert index.positions_by_measure_id("m-4") == [4]
+    assert index.by_measure_id("m-9") == []
+    assert index.by_name("cam") == [stations[0]]
+    assert index.by_name("ST IVES") == [stations[3]]
+    assert normalise_name("  St. Ives ") == "st ives"
+
+    # Assert that prefix search finds names starting with the prefix, sorted by name
+    assert [s.name for s in index.search("Cam")] == ["Cam", "Cambridge", "Cambridge Jesus Lock", "Camden"]
+    assert [s.name for s in index.search("cambridge")] == ["Cambridge", "Cambridge Jesus Lock"]
+    assert index.search("x") == []
+
+    # Assert that fuzzy search finds similar names
+    assert [s.name for s in index.fuzzy_search("Cambrige", n=1)] == ["Cambridge"]
+    assert [s.name for s in index.fuzzy_search("St Ive")] == ["St. Ives"]
+
+    # Assert that indexes are cached for tables and registries until the stations change
+    table = StationTable.from_stations(stations)
+    assert station_index(table) is station_index(table)
+    assert station_index(table).by_station_id("s-1").name == "Cambridge Jesus Lock"
+    table[1].name = "Jesus Lock"
+    assert station_index(table).by_name("jesus lock")[0].station_id == "s-1"
+    registry = StationRegistry(stations)
+    assert station_index(registry) is registry.index()
+    registry.remove(stations[0])
+    assert registry.index().by_name("Cam") == []
+
+
+def test_measure_positions():
+    """Tests subroutine measure_positions"""
+
+    stations = example_stations()
+    positions = measure_positions(stations)
+
+    # Assert that positions match the index
+    assert positions == {measure_id: StationIndex(stations).positions_by_measure_id(measure_id)
+                         for measure_id in positions}
+    assert positions["m-0"] == [0, 5]
+
+    # Assert that the cached index is used for tables and registries
+    table = StationTable.from_stations(stations)
+    assert measure_positions(table) is station_index(table)._measure_id
+    registry = StationRegistry(stations)
+    assert measure_positions(registry) == positions
+    assert registry.stats()['misses'] == 1
@@ -0,0 +1,76 @@
+"""Unit tests for the stationtable module"""
+
+import numpy as np
+
+from floodsystem.station import MonitoringStation
+from floodsystem.stationtable import StationTable
+
+
+def example_stations():
+    """Returns a list of example MonitoringStation objects"""
+    return [MonitoringStation("s-1", "m-1", "Station 1", (52.2, 0.1), (0.1, 0.9), "River A", "Town A", "Catchment"),
+            MonitoringStation("s-2", "m-2", "Station 2", (51.5, -0.5), None, "River B", None, "Catchment"),
+            MonitoringStation("s-3", "m-3", "Station 3", (50.0, -3.0), (2.0, 1.0), "River A", "Town B", None)]
+
+
+def test_station_table():
+    """Tests creating a StationTable object and reading stations from it"""
+
+    stations = example_stations()
+    stations[0].latest_level = 0.5
+    table = StationTable.from_stations(stations)
+
+    # Assert that the table has columns of the station data
+    assert len(table) == 3
+    assert list(table.lat) == [52.2, 51.5, 50.0]
+    assert np.isnan(table.latest_level[1])
+    assert list(table.codes("river")) == [0, 1, 0]
+    assert table.categories("river") == ["River A", "River B"]
+    assert list(table.codes("town")) == [0, -1, 1]
+
+    # Assert that station views match the stations
+    for station, view in zip(stations, table):
+        assert repr(station) == repr(view)
+        assert station.latest_level == view.latest_level
+        assert station.typical_range_consistent() == view.typical_range_consistent()
+        assert station.relative_water_level() == view.relative_water_level()
+    assert table[-1].catchment is None
+    assert [view.name for view in table[1:]] == ["Station 2", "Station 3"]
+
+    # Assert that views of the same row are equal
+    assert table[0] == table[0]
+    assert table[0] != table[1]
+    assert len({table[0], table[0]}) == 1
+
+
+def test_station_view_set():
+    """Tests changing station data through a StationView object"""
+
+    table = StationTable.from_stations(example_stations())
+    version = table.version
+
+    # Assert that setting the latest level updates the table (without changing the version)
+    table[1].latest_level = 1.5
+    assert table.latest_level[1] == 1.5
+    table[1].latest_level = None
+    assert np.isnan(table.latest_level[1])
+    assert table.version == version
+
+    # Assert that setting other data updates the table and changes the version
+    table[1].town = "Town A"
+    table[1].river = "River C"
+    table[1].typical_range = (0.0, 2.0)
+    assert list(table.codes("town")) == [0, 0, 1]
+    assert table[1].river == "River C"
+    assert table[1].typical_range == (0.0, 2.0)
+    assert table.version > version
+
+    # Assert that views have the get_ and set_ accessors of MonitoringStation
+    view, station = table[2], example_stations()[2]
+    for attribute in ("station_id", "measure_id", "name", "coord", "typical_range", "river", "town",
+                      "latest_level", "catchment"):
+        assert getattr(view, "get_" + attribute)() == getattr(station, "get_" + attribute)()
+    view.set_name("Station C")
+    view.set_catchment("Catchment")
+    assert table.name[2] == "Station C"
+    assert view.get_catchment() == "Catchment"
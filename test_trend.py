@@ -0,0 +1,63 @@
+"""Unit tests for the trend module"""
+
+import numpy as np
+
+from floodsystem import datafetcher, trend
+from floodsystem.analysis import linear_slope
+from floodsystem.flood import get_level_rise, get_station_flood_risk
+from floodsystem.station import MonitoringStation
+from floodsystem.stationdata import update_water_levels
+from floodsystem.trend import OnlineTrend, TrendStore
+
+
+def test_online_trend():
+    """Tests that OnlineTrend objects match the least squares slope of the
+    readings in the window"""
+
+    rng = np.random.default_rng(0)
+    times = 19000 + np.cumsum(rng.uniform(0.005, 0.02, 3000))
+    levels = np.sin(times) + rng.normal(0, 0.01, len(times))
+
+    online = OnlineTrend(window=2)
+    assert online.slope() is None
+    for i, (t, y) in enumerate(zip(times, levels)):
+        assert online.update(t, y)
+        if i % 97 == 0 and i > 0:
+            window = times >= t - 2
+            window[i + 1:] = False
+            assert len(online) == window.sum()
+            assert abs(online.slope() - linear_slope(times[window], levels[window])) < 1e-8
+
+    # Assert that old and missing readings are ignored
+    assert not online.update(times[-1], 1.0)
+    assert not online.update(times[-1] + 0.01, np.nan)
+    assert online.latest() == (times[-1], levels[-1])
+
+
+def test_update_water_levels_trends(monkeypatch):
+    """Tests that update_water_levels keeps trends up to date, for use by
+    get_station_flood_risk"""
+
+    station = MonitoringStation("s-1", "m-1", "Station 1", (52.0, 0.0), (0.0, 1.0), "River", "Town", None)
+    store = TrendStore()
+    monkeypatch.setattr(trend, "_trend_store", store)
+
+    def fake_fetch_latest_water_level_data(stream=False):
+        return {"items": [{"latestReading": {"measure": "m-1", "dateTime": date_time, "value": value}},
+                          {"latestReading": {"measure": "m-2", "dateTime": date_time, "value": value}}]}
+    monkeypatch.setattr(datafetcher, "fetch_latest_water_level_data", fake_fetch_latest_water_level_data)
+
+    # Level rising by 0.05 m every 15 minutes (4.8 m/day), with the same
+    # reading fetched twice
+    for i in [0, 1, 1, 2, 3]:
+        date_time = "2024-01-01T{:02d}:{:02d}:00Z".format(i // 4, 15 * (i % 4))
+        value = 0.5 + 0.05 * i
+        update_water_levels([station])
+
+    # Assert that only readings for the stations are used, and only once
+    assert len(store) == 1 and len(store.get("m-1")) == 4
+    assert abs(store.slope("m-1") - 4.8) < 1e-6
+
+    # Assert that the rise is found without level data
+    assert abs(get_level_rise(station, estimator='online') - 4.8) < 1e-6
+    assert get_station_flood_risk(station, estimator='online') == 2